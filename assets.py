@@ -0,0 +1,163 @@
+"""
+Static asset build and serving.
+
+The build step copies public/ and marketing/ into build/, adding a
+content-hashed copy of every asset (main.js -> main.3f9c1e20ab.js) plus
+gzip and brotli siblings of each text file, and rewrites the HTML to
+reference the hashed names. ES modules keep importing each other by plain
+name (`./api.js`); the rewritten import map sends those URLs to the hashed
+files, so a changed module only invalidates itself.
+
+    python assets.py
+
+Without a build, main.py serves the source directories directly.
+"""
+import gzip, hashlib, json, os, re, shutil
+from mimetypes import guess_type
+from pathlib import Path
+
+import brotli
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+ROOT      = Path(__file__).parent
+BUILD_DIR = ROOT / "build"
+SOURCES   = {"public": "/assets", "marketing": "/marketing"}   # source dir -> URL prefix
+
+MANIFEST      = "manifest.json"
+COMPRESSIBLE  = {".html", ".js", ".css", ".json", ".svg", ".txt"}
+COMPRESS_MIN  = 256            # bytes; smaller files aren't worth a second request path
+IMMUTABLE     = "public, max-age=31536000, immutable"
+REVALIDATE    = "no-cache"
+
+_IMPORTMAP = re.compile(r'(<script type="importmap">\s*)(.*?)(\s*</script>)', re.S)
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def _fingerprint(rel: Path, data: bytes) -> Path:
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    return rel.with_name(f"{rel.stem}.{digest}{rel.suffix}")
+
+
+def _rewrite_html(html: str, prefix: str, manifest: dict[str, str]) -> str:
+    for name, hashed in manifest.items():
+        html = html.replace(f'"{prefix}/{name}"', f'"{prefix}/{hashed}"')
+    match = _IMPORTMAP.search(html)
+    if match:
+        importmap = json.loads(match.group(2))
+        importmap.setdefault("imports", {}).update({
+            f"{prefix}/{name}": f"{prefix}/{hashed}"
+            for name, hashed in manifest.items() if name.endswith(".js")
+        })
+        body = json.dumps(importmap, indent=2)
+        html = html[:match.start(2)] + body + html[match.end(2):]
+    return html
+
+
+def _compress(path: Path) -> None:
+    data = path.read_bytes()
+    if path.suffix not in COMPRESSIBLE or len(data) < COMPRESS_MIN:
+        return
+    # mtime=0 keeps the .gz byte-identical across builds
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
+
+
+def build(src: Path, dest: Path, prefix: str) -> dict[str, str]:
+    """Build one source directory into `dest`; returns its manifest."""
+    if dest.exists():
+        shutil.rmtree(dest)
+    dest.mkdir(parents=True)
+    manifest, pages = {}, []
+    for path in sorted(p for p in src.rglob("*") if p.is_file()):
+        rel = path.relative_to(src)
+        if path.suffix == ".html":
+            pages.append(rel)
+            continue
+        data = path.read_bytes()
+        hashed = _fingerprint(rel, data)
+        manifest[rel.as_posix()] = hashed.as_posix()
+        for out in (dest / rel, dest / hashed):
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_bytes(data)
+            _compress(out)
+    for rel in pages:
+        out = dest / rel
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(_rewrite_html((src / rel).read_text(), prefix, manifest))
+        _compress(out)
+    (dest / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest
+
+
+def built(src: Path) -> Path:
+    """The build output for `src` if there is one, otherwise `src` itself."""
+    dest = BUILD_DIR / src.name
+    return dest if (dest / MANIFEST).exists() else src
+
+
+# ── Serving ───────────────────────────────────────────────────────────────────
+
+def accepted_codings(header: str) -> set[str]:
+    codings = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        codings.add(name.strip().lower())
+    return codings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves a .br/.gz sibling when the client accepts it,
+    and marks fingerprinted files (those listed in the directory's build
+    manifest) as immutable. Everything else is revalidated on each use."""
+
+    def __init__(self, *, directory: Path, **kwargs):
+        super().__init__(directory=str(directory), **kwargs)
+        manifest = Path(directory) / MANIFEST
+        self._immutable = set(json.loads(manifest.read_text()).values()) if manifest.exists() else set()
+        self._root = Path(directory).resolve()
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        accepted = accepted_codings(request_headers.get("accept-encoding", ""))
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        response = None
+        for coding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            sibling = f"{full_path}{suffix}"
+            if coding in accepted and os.path.isfile(sibling):
+                response = FileResponse(sibling, status_code=status_code, stat_result=os.stat(sibling),
+                                        media_type=media_type, headers={"Content-Encoding": coding})
+                break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code,
+                                    stat_result=stat_result, media_type=media_type)
+        rel = Path(full_path).resolve().relative_to(self._root).as_posix()
+        response.headers["Cache-Control"] = IMMUTABLE if rel in self._immutable else REVALIDATE
+        response.headers["Vary"] = "Accept-Encoding"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content-addressed files, which never change under a name."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+if __name__ == "__main__":
+    for name, prefix in SOURCES.items():
+        manifest = build(ROOT / name, BUILD_DIR / name, prefix)
+        print(f"{name}: {len(manifest)} assets -> {BUILD_DIR / name}")
@@ -5,6 +5,8 @@ from jose import JWTError, jwt
 from dotenv import load_dotenv
 import os
 
+from database import current_tenant
+
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "insecure-default-change-me")
@@ -15,14 +17,25 @@ TOKEN_EXPIRE_DAYS = 7
 bearer_scheme = HTTPBearer()
 
 
+def secret_key() -> str:
+    """The current tenant's signing key in pooled mode, else SECRET_KEY."""
+    tenant = current_tenant.get()
+    return tenant.secret_key if tenant is not None else SECRET_KEY
+
+
+def passphrase() -> str:
+    tenant = current_tenant.get()
+    return tenant.passphrase if tenant is not None else PASSPHRASE
+
+
 def create_access_token() -> str:
     expire = datetime.now(timezone.utc) + timedelta(days=TOKEN_EXPIRE_DAYS)
     payload = {"sub": "owner", "exp": expire}
-    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(payload, secret_key(), algorithm=ALGORITHM)
 
 
-def verify_passphrase(passphrase: str) -> bool:
-    return passphrase == PASSPHRASE
+def verify_passphrase(given: str) -> bool:
+    return given == passphrase()
 
 
 async def get_current_user(
@@ -30,7 +43,7 @@ async def get_current_user(
 ) -> str:
     token = credentials.credentials
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, secret_key(), algorithms=[ALGORITHM])
         sub: str = payload.get("sub")
         if sub != "owner":
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
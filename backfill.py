@@ -0,0 +1,99 @@
+"""Compute stored metadata for images uploaded before it existed.
+
+    python backfill.py [--batch-size 100] [--workers 2]
+
+Fills width, height, byte size, content hash and placeholder on post images
+and the avatar. Each batch is described in parallel worker processes and
+written back in one transaction. Safe to re-run; only rows without a content
+hash are touched. In pooled tenancy it goes through every active hub.
+
+The web processes' read caches are not told about the new metadata (the
+revision bump only reaches this process's cache), so restart them after a
+run, or wait READ_CACHE_TTL seconds where one is set.
+"""
+import argparse
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+import images
+import storage
+import tenancy
+from conditional import bump_revision
+from database import POOLED, Tenant, current_tenant, db, tenant_context
+from models import PostImage, Profile
+
+
+def _describe_stored(filename: str, tenant: Tenant | None) -> dict | None:
+    # Worker processes don't inherit current_tenant, so it is passed along
+    try:
+        with tenant_context(tenant):
+            data = storage.read(filename)
+        return images.describe(io.BytesIO(data))
+    except Exception as e:   # missing object, storage error
+        print(f"Skipping {filename}: {e}")
+        return None
+
+
+def backfill_post_images(pool: ProcessPoolExecutor, batch_size: int) -> int:
+    done, last_id = 0, 0
+    while True:
+        batch = list(PostImage
+                     .select(PostImage.id, PostImage.filename)
+                     .where(PostImage.content_hash.is_null(), PostImage.id > last_id)
+                     .order_by(PostImage.id)
+                     .limit(batch_size)
+                     .tuples())
+        if not batch:
+            return done
+        last_id = batch[-1][0]
+        # Fetch and decode before the transaction, so it never waits on storage
+        filenames = [filename for _, filename in batch]
+        metas = list(pool.map(_describe_stored, filenames, [current_tenant.get()] * len(filenames)))
+        with db.atomic():
+            for (image_id, _), meta in zip(batch, metas):
+                if meta is not None:
+                    PostImage.update(**meta).where(PostImage.id == image_id).execute()
+                    done += 1
+        print(f"post images: {done} updated (through id {last_id})")
+
+
+def backfill_avatar() -> int:
+    profile = Profile.get_or_none()
+    if profile is None or not profile.avatar_filename or profile.avatar_content_hash:
+        return 0
+    meta = _describe_stored(profile.avatar_filename, current_tenant.get())
+    if meta is None:
+        return 0
+    Profile.update(**{f"avatar_{k}": v for k, v in meta.items()}).where(Profile.id == profile.id).execute()
+    return 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1].strip())
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    if POOLED:
+        with db.connection_context():
+            tenants = tenancy.active_tenants()
+    else:
+        tenants = [None]
+
+    updated = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for tenant in tenants:
+            with tenant_context(tenant), db.connection_context():
+                if tenant is not None:
+                    print(f"hub {tenant.slug}")
+                n = backfill_post_images(pool, args.batch_size) + backfill_avatar()
+                if n:
+                    bump_revision()
+            updated += n
+    print(f"done: {updated} image(s) updated")
+    if updated:
+        print("restart the web processes to drop their cached responses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare FastAPI's default response path with FAST_JSON on a 500-post feed page.
+
+Run from the repo root:  python -m benchmarks.feed_json
+No database is needed; the feed is synthetic but shaped like _paginate() output.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+
+from fastapi import Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+import images
+import storage
+from schemas import PostPage
+
+POSTS  = 500
+ROUNDS = 20
+
+
+def _image(image_id: int, filename: str, order: int) -> dict:
+    variants, srcset = images.variant_fields(filename, images.VARIANT_WIDTHS)
+    return {"id": image_id, "filename": filename, "url": storage.public_url(filename), "order": order,
+            "variants": variants, "srcset": srcset,
+            "width": 1600, "height": 1200, "byte_size": 412_345,
+            "content_hash": hashlib.sha256(filename.encode()).hexdigest(),
+            "placeholder": "data:image/webp;base64," + "A" * 44}
+
+
+def _feed() -> dict:
+    start = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    items = []
+    for i in range(POSTS):
+        items.append({
+            "id": i + 1,
+            "caption": f"Post number {i} with a caption of a realistic length for a photo feed." * 2,
+            "location": "Brooklyn, NY" if i % 3 else None,
+            "published": True,
+            "created_at": start - timedelta(hours=i),
+            "images": [_image(i * 10 + j, f"{i:08x}-{j}.jpg", j) for j in range(4)],
+            "tags": [{"id": t, "name": f"tag{t}"} for t in range(i % 5)],
+        })
+    page = {"items": items, "next_cursor": "WyIyMDI0LTAxLTAxVDEyOjAwOjAwIiwgMV0"}
+    PostPage.model_validate(page)   # fails here, not mid-benchmark, if the schema moved on
+    return page
+
+
+async def _default(field, page: dict) -> bytes:
+    content = await serialize_response(field=field, response_content=page, is_coroutine=False)
+    return JSONResponse(content).body
+
+
+def _fast(page: dict) -> bytes:
+    return ORJSONResponse(page, headers=dict(Response().headers)).body
+
+
+def _time(fn) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main() -> None:
+    page  = _feed()
+    field = create_model_field(name="Response_list_posts", type_=PostPage, mode="serialization")
+    loop  = asyncio.new_event_loop()
+
+    default_body = loop.run_until_complete(_default(field, page))
+    fast_body    = _fast(page)
+    assert json.loads(default_body) == json.loads(fast_body), "encoders disagree"
+
+    default_ms = _time(lambda: loop.run_until_complete(_default(field, page)))
+    fast_ms    = _time(lambda: _fast(page))
+    print(f"{POSTS}-post feed, best of {ROUNDS} rounds, {len(fast_body) / 1024:.0f} KiB body")
+    print(f"  response_model + json : {default_ms:8.2f} ms")
+    print(f"  FAST_JSON (orjson)    : {fast_ms:8.2f} ms   ({default_ms / fast_ms:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Concurrent checkouts against a local Stripe stand-in.
+
+Run from the repo root:  python -m benchmarks.stripe_checkout
+No Stripe account or database is needed. The stand-in answers
+POST /v1/checkout/sessions after LATENCY seconds, like a slow round trip
+to Stripe. The benchmark fires CONCURRENCY checkouts at once two ways:
+with the old blocking stripe.checkout.Session.create inside the handler,
+and through POST /api/checkout/create-session. The blocking calls queue
+up behind each other on the event loop; the async client overlaps them.
+"""
+import asyncio
+import os
+import secrets
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+HOST, PORT  = "127.0.0.1", 12111
+LATENCY     = 0.25   # s per Stripe call
+CONCURRENCY = 20
+
+# Must be set before routers.checkout builds its client
+os.environ["STRIPE_API_BASE"] = f"http://{HOST}:{PORT}"
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_standin")
+os.environ.setdefault("STRIPE_PRICE_ID", "price_standin")
+
+import httpx
+import stripe
+
+from routers import checkout
+
+standin = FastAPI()
+
+
+@standin.post("/v1/checkout/sessions")
+async def create_checkout_session(request: Request):
+    form = await request.form()
+    await asyncio.sleep(LATENCY)
+    session_id = f"cs_test_{secrets.token_hex(12)}"
+    return {
+        "id": session_id,
+        "object": "checkout.session",
+        "mode": form.get("mode"),
+        "success_url": form.get("success_url"),
+        "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+    }
+
+
+def serve_standin() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(standin, host=HOST, port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+async def blocking_checkout() -> str:
+    # The previous create_session body: a synchronous call in an async handler
+    session = stripe.checkout.Session.create(
+        api_key=os.environ["STRIPE_SECRET_KEY"],
+        mode="subscription",
+        line_items=[{"price": checkout.PRICE_ID, "quantity": 1}],
+        success_url=f"{checkout.BASE_URL}/success",
+        cancel_url=f"{checkout.BASE_URL}/",
+    )
+    return session.url
+
+
+def app_client() -> httpx.AsyncClient:
+    """Client for an app serving only the checkout router, in process."""
+    app = FastAPI()
+    app.include_router(checkout.router)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app")
+
+
+async def endpoint_checkout(client: httpx.AsyncClient) -> str:
+    response = await client.post("/api/checkout/create-session")
+    response.raise_for_status()
+    return response.json()["url"]
+
+
+async def concurrently(make_call, n: int = CONCURRENCY) -> float:
+    """Run `n` checkouts at once; returns the seconds they took together."""
+    start = time.perf_counter()
+    urls = await asyncio.gather(*(make_call() for _ in range(n)))
+    elapsed = time.perf_counter() - start
+    assert all(u and u.startswith("https://checkout.stripe.com/") for u in urls)
+    return elapsed
+
+
+async def timed(label: str, make_call) -> None:
+    elapsed = await concurrently(make_call)
+    print(f"{label:<28} {CONCURRENCY} checkouts in {elapsed:6.2f}s "
+          f"({elapsed / (CONCURRENCY * LATENCY):.1f}x a serial run)")
+
+
+async def main() -> None:
+    stripe.api_base = os.environ["STRIPE_API_BASE"]
+    async with app_client() as client:
+        print(f"Stripe stand-in latency {LATENCY * 1000:.0f} ms")
+        await timed("blocking Session.create", blocking_checkout)
+        await timed("async client (endpoint)", lambda: endpoint_checkout(client))
+
+
+if __name__ == "__main__":
+    server = serve_standin()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
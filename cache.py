@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from database import POOLED, current_tenant
+
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "256"))
+
+# Pooled mode: a tenant is served by several instances, and a write only
+# invalidates the instance that handled it, so entries expire after this
+# many seconds. 0 keeps them until invalidated (dedicated mode's default).
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "5" if POOLED else "0"))
+
+# Pooled mode: tenants with a cache on one instance; the least recently
+# served one is dropped beyond this.
+READ_CACHE_TENANTS = int(os.getenv("READ_CACHE_TENANTS", "1000"))
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU map of serialized responses with hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._expires: dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a value computed across a concurrent
+        # write is returned to its caller but never stored.
+        self._generation = 0
+
+    def get_or_set(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._data and self.ttl and self._expires[key] <= time.monotonic():
+                del self._data[key]
+                del self._expires[key]
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            generation = self._generation
+        value = compute()
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl:
+                self._expires[key] = time.monotonic() + self.ttl
+            while len(self._data) > self.maxsize:
+                self._expires.pop(self._data.popitem(last=False)[0], None)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        """Drop every tuple key whose first element is `prefix`."""
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._data if k[0] == prefix]:
+                del self._data[key]
+                self._expires.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class TenantCaches:
+    """One LRUCache per tenant, with the same interface, picking the current
+    tenant's on each call. Keeps one hub's traffic from evicting another's
+    entries, and keys from colliding across schemas."""
+
+    def __init__(self, maxsize: int, ttl: float = 0, max_tenants: int = READ_CACHE_TENANTS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_tenants = max_tenants
+        self._caches: OrderedDict[str | None, LRUCache] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache(self) -> LRUCache:
+        tenant = current_tenant.get()
+        schema = tenant.schema if tenant is not None else None
+        with self._lock:
+            cache = self._caches.get(schema)
+            if cache is None:
+                cache = self._caches[schema] = LRUCache(self.maxsize, self.ttl)
+                while len(self._caches) > self.max_tenants:
+                    self._caches.popitem(last=False)
+            self._caches.move_to_end(schema)
+        return cache
+
+    def get_or_set(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        return self._cache().get_or_set(key, compute)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._cache().invalidate(key)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        self._cache().invalidate_prefix(prefix)
+
+    def stats(self) -> dict:
+        """The current tenant's counters, plus how many tenants are cached."""
+        with self._lock:
+            tenants = len(self._caches)
+        return {**self._cache().stats(), "tenants": tenants, "max_tenants": self.max_tenants}
+
+
+# Public reads only: the profile, single published posts and published feed pages.
+read_cache = (TenantCaches(READ_CACHE_SIZE, READ_CACHE_TTL) if POOLED
+              else LRUCache(READ_CACHE_SIZE, READ_CACHE_TTL))
@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+from cache import read_cache
+from database import db
+from models import Revision
+
+# Browsers always revalidate; a shared cache (CDN in front of the ALB) may
+# serve a stored copy for a short while and keep serving it stale while it
+# revalidates in the background.
+PUBLIC_CACHE_CONTROL = "public, max-age=0, s-maxage=60, stale-while-revalidate=300"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def bump_revision() -> None:
+    """Record that public content changed.
+
+    Call inside the write's connection context but after its transaction has
+    committed, so a concurrent read cannot re-cache the old revision. Also
+    pins reads to the primary until the replica has caught up.
+    """
+    now = datetime.now(timezone.utc)
+    (Revision
+     .insert(id=1, value=1, updated_at=now)
+     .on_conflict(
+         conflict_target=[Revision.id],
+         update={Revision.value: Revision.value + 1, Revision.updated_at: now},
+     )
+     .execute())
+    db.pin_primary()
+    read_cache.invalidate(("revision",))
+
+
+def _load_revision() -> tuple[str, datetime]:
+    with db.connection_context():
+        rev = Revision.get_or_none(Revision.id == 1)
+    if rev is None:
+        return '"0"', _EPOCH
+    return f'"{rev.value}"', rev.updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def current_revision() -> tuple[str, datetime]:
+    """ETag and Last-Modified of the current content revision. Opens its own
+    connection on a cache miss."""
+    return read_cache.get_or_set(("revision",), _load_revision)
+
+
+def _is_fresh(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison: a gzipped response carried W/"<etag>"
+        candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional(request: Request, response: Response) -> Optional[Response]:
+    """Answer a conditional GET for the current content revision.
+
+    Returns a 304 response when the client's copy is current. Otherwise sets
+    the validators and cache policy on `response` and returns None, and the
+    handler goes on to build the body. Opens its own connection on a cache
+    miss, so call it outside the handler's connection context.
+    """
+    etag, last_modified = current_revision()
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": PUBLIC_CACHE_CONTROL,
+    }
+    if _is_fresh(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
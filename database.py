@@ -1,13 +1,288 @@
-import os, re
+import os, re, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+import psycopg2
 from dotenv import load_dotenv
-from peewee import PostgresqlDatabase
+from playhouse.pool import MaxConnectionsExceeded, PooledDatabase, PooledPostgresqlDatabase
 from urllib.parse import urlparse
 
 load_dotenv()
-_url = os.getenv("DATABASE_URL", "postgresql://localhost/crimata")
-_url = re.sub(r'\+\w+', '', _url)   # strip +asyncpg etc.
-_p = urlparse(_url)
-db = PostgresqlDatabase(
-    _p.path.lstrip('/'), host=_p.hostname, port=_p.port or 5432,
-    user=_p.username or '', password=_p.password or '',
+
+# Pool sizing. Every tenant container shares one RDS instance, so
+# DB_POOL_MAX_CONNECTIONS is a hard cap on this process's connections; the
+# tenant's Postgres role carries a CONNECTION LIMIT as well (provisioning.db_setup).
+POOL_MAX_CONNECTIONS = int(os.getenv("DB_POOL_MAX_CONNECTIONS", "5"))
+POOL_STALE_TIMEOUT   = int(os.getenv("DB_POOL_STALE_TIMEOUT", "300"))   # recycle connections older than this (s)
+POOL_WAIT_TIMEOUT    = int(os.getenv("DB_POOL_WAIT_TIMEOUT", "10"))     # wait this long for a free connection (s)
+POOL_CHECK_IDLE      = int(os.getenv("DB_POOL_CHECK_IDLE", "30"))       # ping connections idle longer than this (s)
+CONNECT_TIMEOUT      = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
+# After a write, reads stay on the primary for this long so the owner (and the
+# read cache) never see the replica's pre-write state. Keep it above the
+# replica's worst expected lag.
+REPLICA_PIN_SECONDS  = float(os.getenv("DB_REPLICA_PIN_SECONDS", "5"))
+
+# dedicated: one container and database per tenant (the default).
+# pooled: one fleet serves every tenant, each in its own schema of the shared
+# database, picked per request from the Host header (tenancy.py).
+TENANCY = os.getenv("TENANCY", "dedicated")
+POOLED  = TENANCY == "pooled"
+
+# Pooled mode: connections one tenant may hold at once, so a busy hub cannot
+# take the whole pool.
+TENANT_MAX_CONNECTIONS = int(os.getenv("DB_TENANT_MAX_CONNECTIONS", "2"))
+
+
+@dataclass(frozen=True)
+class Tenant:
+    slug: str
+    schema: str
+    secret_key: str
+    passphrase: str
+
+
+# The tenant being served. None in dedicated mode, and for control-plane work
+# (marketing, checkout, provisioning) in pooled mode.
+current_tenant: ContextVar[Tenant | None] = ContextVar("current_tenant", default=None)
+
+
+def _schema() -> str | None:
+    tenant = current_tenant.get()
+    return tenant.schema if tenant is not None else None
+
+
+@contextmanager
+def tenant_context(tenant: Tenant | None):
+    """Run the block as `tenant`: its schema, caches and storage prefix."""
+    token = current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+class MonitoredPooledDatabase(PooledPostgresqlDatabase):
+    """Pooled Postgres database that health-checks long-idle connections on
+    checkout and records how long callers wait for a free connection.
+
+    In pooled tenancy it also points each checkout at the current tenant's
+    schema, and lets one tenant hold at most `tenant_max_connections`.
+    """
+
+    def __init__(self, *args, check_idle: int = 30, tenant_max_connections: int = 2, **kwargs):
+        self._check_idle = check_idle
+        self._idle_since: dict[int, float] = {}
+        self._stats_lock = threading.Lock()
+        self._waits = self._timeouts = self._failed_pings = 0
+        self._wait_total = self._wait_max = 0.0
+        # Pooled tenancy: connections in use per schema, and each connection's
+        # current search_path
+        self._tenant_max = tenant_max_connections
+        self._tenant_in_use: dict[str, int] = {}
+        self._tenant_of: dict[int, str] = {}
+        self._search_path: dict[int, str] = {}
+        self._tenant_slots = threading.Condition()
+        super().__init__(*args, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        if not POOLED or not self.is_closed():
+            return self._checkout(reuse_if_open)
+        schema = _schema()
+        if schema is not None:
+            self._acquire_tenant_slot(schema)
+        try:
+            opened = self._checkout(reuse_if_open)
+        except Exception:
+            if schema is not None:
+                self._release_tenant_slot(schema)
+            raise
+        conn = self._state.conn
+        key = self.conn_key(conn)
+        search_path = f'"{schema}", public' if schema else "public"
+        if self._search_path.get(key) != search_path:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"SET search_path TO {search_path}")
+            except Exception:
+                # Its search_path is unknown now; close it rather than pool it
+                self.manual_close()
+                if schema is not None:
+                    self._release_tenant_slot(schema)
+                raise
+            self._search_path[key] = search_path
+        if schema is not None:
+            self._tenant_of[key] = schema
+        return opened
+
+    def _acquire_tenant_slot(self, schema: str) -> None:
+        start = time.monotonic()
+        with self._tenant_slots:
+            waited = False
+            while self._tenant_in_use.get(schema, 0) >= self._tenant_max:
+                waited = True
+                remaining = self._wait_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._record_wait(time.monotonic() - start, timed_out=True)
+                    raise MaxConnectionsExceeded(f"{schema} is at its limit of {self._tenant_max} connections")
+                self._tenant_slots.wait(remaining)
+            self._tenant_in_use[schema] = self._tenant_in_use.get(schema, 0) + 1
+        if waited:
+            self._record_wait(time.monotonic() - start)
+
+    def _release_tenant_slot(self, schema: str) -> None:
+        with self._tenant_slots:
+            self._tenant_in_use[schema] -= 1
+            if not self._tenant_in_use[schema]:
+                del self._tenant_in_use[schema]
+            self._tenant_slots.notify_all()
+
+    def _checkout(self, reuse_if_open=False):
+        # Same as PooledDatabase.connect(), but measures the time spent waiting.
+        start = time.monotonic()
+        waited = False
+        while True:
+            try:
+                conn = super(PooledDatabase, self).connect(reuse_if_open)
+                break
+            except MaxConnectionsExceeded:
+                waited = True
+                if time.monotonic() - start >= self._wait_timeout:
+                    self._record_wait(time.monotonic() - start, timed_out=True)
+                    raise
+                time.sleep(0.05)
+        if waited:
+            self._record_wait(time.monotonic() - start)
+        return conn
+
+    def _record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._stats_lock:
+            self._waits += 1
+            self._timeouts += timed_out
+            self._wait_total += seconds
+            self._wait_max = max(self._wait_max, seconds)
+
+    def _is_closed(self, conn):
+        if super()._is_closed(conn):
+            self._search_path.pop(self.conn_key(conn), None)   # its id may be reused
+            return True
+        idle_since = self._idle_since.pop(self.conn_key(conn), None)
+        if idle_since is None or time.monotonic() - idle_since < self._check_idle:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return False
+        except psycopg2.Error:
+            # RDS failover, idle timeout on a NAT, ... — drop it and open a new one
+            with self._stats_lock:
+                self._failed_pings += 1
+            conn.close()
+            self._search_path.pop(self.conn_key(conn), None)
+            return True
+
+    def _close(self, conn, close_conn=False):
+        with self._pool_lock:
+            super()._close(conn, close_conn)
+            key = self.conn_key(conn)
+            if any(self.conn_key(c) == key for _, _, c in self._connections):
+                self._idle_since[key] = time.monotonic()   # returned to the pool
+            else:
+                self._idle_since.pop(key, None)
+                self._search_path.pop(key, None)
+        schema = self._tenant_of.pop(key, None)
+        if schema is not None:
+            self._release_tenant_slot(schema)
+
+    def pool_stats(self) -> dict:
+        with self._pool_lock, self._stats_lock:
+            return {
+                "max_connections": self._max_connections,
+                "in_use": len(self._in_use),
+                "idle": len(self._connections),
+                "waits": self._waits,
+                "wait_timeouts": self._timeouts,
+                "wait_seconds_total": round(self._wait_total, 3),
+                "wait_seconds_max": round(self._wait_max, 3),
+                "failed_health_checks": self._failed_pings,
+                **({"tenants_connected": len(self._tenant_in_use)} if POOLED else {}),
+            }
+
+
+class ReplicaRouter:
+    """Stands in for the database models are bound to.
+
+    Everything goes to the primary, except queries run inside
+    `read_context()`, which go to the read replica when one is configured
+    and no recent write has pinned reads to the primary. The choice is
+    per thread, so concurrent requests can use different targets. In pooled
+    mode, a write pins only its own tenant's reads.
+    """
+
+    def __init__(self, primary: MonitoredPooledDatabase,
+                 replica: MonitoredPooledDatabase | None = None,
+                 pin_seconds: float = 5):
+        self.primary = primary
+        self.replica = replica
+        self._pin_seconds = pin_seconds
+        self._pinned_until: dict[str | None, float] = {}   # by tenant schema
+        self._local = threading.local()
+
+    @property
+    def target(self) -> MonitoredPooledDatabase:
+        return getattr(self._local, "target", None) or self.primary
+
+    def __getattr__(self, attr):
+        return getattr(self.target, attr)
+
+    @contextmanager
+    def read_context(self):
+        """connection_context() for read-only work that may run on the replica."""
+        target = self.primary
+        if self.replica is not None and time.monotonic() >= self._pinned_until.get(_schema(), 0):
+            target = self.replica
+        previous = getattr(self._local, "target", None)
+        self._local.target = target
+        try:
+            with target.connection_context():
+                yield
+        finally:
+            self._local.target = previous
+
+    def pin_primary(self) -> None:
+        """Route reads to the primary for the next `pin_seconds`."""
+        now = time.monotonic()
+        for schema, until in list(self._pinned_until.items()):
+            if until <= now:
+                self._pinned_until.pop(schema, None)
+        self._pinned_until[_schema()] = now + self._pin_seconds
+
+    def pool_stats(self) -> dict:
+        stats = self.primary.pool_stats()
+        if self.replica is not None:
+            stats["replica"] = self.replica.pool_stats()
+            stats["replica"]["pinned_to_primary"] = time.monotonic() < self._pinned_until.get(_schema(), 0)
+        return stats
+
+
+def _pool(url: str) -> MonitoredPooledDatabase:
+    url = re.sub(r'\+\w+', '', url)   # strip +asyncpg etc.
+    p = urlparse(url)
+    return MonitoredPooledDatabase(
+        p.path.lstrip('/'), host=p.hostname, port=p.port or 5432,
+        user=p.username or '', password=p.password or '',
+        connect_timeout=CONNECT_TIMEOUT,
+        max_connections=POOL_MAX_CONNECTIONS,
+        stale_timeout=POOL_STALE_TIMEOUT,
+        timeout=POOL_WAIT_TIMEOUT,
+        check_idle=POOL_CHECK_IDLE,
+        tenant_max_connections=TENANT_MAX_CONNECTIONS,
+    )
+
+
+_replica_url = os.getenv("DATABASE_REPLICA_URL")
+db = ReplicaRouter(
+    _pool(os.getenv("DATABASE_URL", "postgresql://localhost/crimata")),
+    _pool(_replica_url) if _replica_url else None,
+    pin_seconds=REPLICA_PIN_SECONDS,
 )
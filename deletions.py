@@ -0,0 +1,285 @@
+"""Deferred, batched deletion of stored objects.
+
+Handlers never delete objects themselves. In the transaction that removes
+or repoints the rows, they call release(), which queues the original and
+all of its possible variants in pending_deletions. A worker thread flushes
+the queue in batches: one S3 delete_objects call per 1000 keys, or bulk
+unlinks locally. Before deleting, it re-checks that nothing references the
+original again, because content-addressed objects can be re-uploaded at any
+time. If a request dies halfway through, its transaction rolls back and
+queues nothing.
+
+Rows that start referencing an original again go through retain() in
+their own transaction: it takes an advisory lock on the content (shared by
+the original and its variants) and cancels their queued deletions.
+flush() holds the same lock from its reference check until the delete is
+done, so the two never interleave; storage calls run outside any
+transaction. Keys that fail to delete are retried with backoff.
+
+The sweeper periodically queues objects that no row references and that
+are older than ORPHAN_MIN_AGE, such as direct uploads that were never
+confirmed or leftovers of earlier bugs. It refuses to run against a
+bucket without a STORAGE_PREFIX, where it would see other deployments'
+objects as orphans.
+
+In pooled tenancy each hub has its own queue in its schema. wake() marks
+the current hub, and the worker flushes only the hubs marked since its last
+round; the periodic sweep covers every hub, which also retries entries left
+queued by failed deletes. To run one pass by hand:
+
+    python deletions.py [--sweep]
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import images
+import storage
+import tenancy
+from database import POOLED, Tenant, current_tenant, db, tenant_context
+from models import PendingDeletion, PostImage, Profile
+
+BATCH_SIZE     = 1000   # S3 delete_objects limit
+FLUSH_INTERVAL = float(os.getenv("DELETE_FLUSH_INTERVAL", "5"))        # s
+SWEEP_INTERVAL = float(os.getenv("ORPHAN_SWEEP_INTERVAL", "3600"))     # s
+ORPHAN_MIN_AGE = float(os.getenv("ORPHAN_MIN_AGE", "86400"))           # s
+RETRY_BASE_DELAY = float(os.getenv("DELETE_RETRY_BASE_DELAY", "60"))   # s, doubled per failed delete
+RETRY_MAX_DELAY  = 6 * 3600                                             # s
+
+_VARIANT = re.compile(r"(.+)_\d+w\.webp")
+
+# First key of the advisory locks taken per stored content (the second is
+# the hash of its _identity())
+LOCK_SPACE = 0x64656C   # "del"
+
+_wake = threading.Event()
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+# Pooled mode: hubs woken since the worker's last round
+_dirty: set[Tenant] = set()
+_dirty_lock = threading.Lock()
+
+
+def _identity(filename: str) -> str:
+    """What an original and its variants have in common: the original's stem."""
+    variant = _VARIANT.fullmatch(filename)
+    return variant.group(1) if variant else Path(filename).stem
+
+
+def _lock(identity: str, wait: bool = True, session: bool = False) -> bool:
+    fn = f"pg_{'' if wait else 'try_'}advisory_{'' if session else 'xact_'}lock"
+    row = db.execute_sql(f"SELECT {fn}(%s, hashtext(%s))", (LOCK_SPACE, identity)).fetchone()
+    return row[0] is not False
+
+
+def _referenced(filenames: set[str]) -> set[str]:
+    """The ones some row references. An orphaned variant queued without its
+    original (see sweep()) counts as referenced if any original of its
+    content is."""
+    used = set(PostImage.select(PostImage.filename).where(PostImage.filename.in_(filenames)).scalars())
+    used |= set(Profile.select(Profile.avatar_filename).where(Profile.avatar_filename.in_(filenames)).scalars())
+    for filename in filenames - used:
+        if _VARIANT.fullmatch(filename):
+            stem = _identity(filename) + "."
+            if (PostImage.select().where(PostImage.filename.startswith(stem)).exists()
+                    or Profile.select().where(Profile.avatar_filename.startswith(stem)).exists()):
+                used.add(filename)
+    return used
+
+
+def _enqueue(rows: list[dict]) -> None:
+    for i in range(0, len(rows), BATCH_SIZE):
+        PendingDeletion.insert_many(rows[i:i + BATCH_SIZE]).on_conflict_ignore().execute()
+
+
+def release(filenames) -> None:
+    """Queue stored originals, and their variants, for deletion once unreferenced.
+
+    Call inside the transaction that removes or repoints the rows that used
+    them, then wake() after it commits. Objects another deployment may share
+    (see storage.owned) are left alone.
+    """
+    rows = [{"key": key, "original": filename}
+            for filename in {f for f in filenames if f and storage.owned(f)}
+            for key in images.stored_filenames(filename, images.VARIANT_WIDTHS)]
+    _enqueue(rows)
+
+
+def retain(filenames) -> None:
+    """Keep originals that rows are about to reference from being deleted.
+
+    Call inside the transaction that inserts or repoints those rows, before
+    writing them. Waits for a flush that is deleting one of them, holds
+    their locks until the transaction ends, and cancels their queued
+    deletions. An original a flush deleted first is gone, so check storage
+    afterwards (routers.uploads.retain_stored does).
+    """
+    originals = {f for f in filenames if f}
+    for identity in sorted({_identity(f) for f in originals}):   # in order, so callers can't deadlock
+        _lock(identity)
+    if originals:
+        keys = [key for f in originals for key in images.stored_filenames(f, images.VARIANT_WIDTHS)]
+        (PendingDeletion
+         .delete()
+         .where(PendingDeletion.original.in_(originals) | PendingDeletion.key.in_(keys))
+         .execute())
+
+
+def wake() -> None:
+    """Flush the queue now rather than at the next interval."""
+    tenant = current_tenant.get()
+    if tenant is not None:
+        with _dirty_lock:
+            _dirty.add(tenant)
+    _wake.set()
+
+
+def _tenants() -> list[Tenant | None]:
+    """Whose queues to work through: every hub in pooled mode, else just
+    the one database."""
+    if not POOLED:
+        return [None]
+    with db.connection_context():
+        return tenancy.active_tenants()
+
+
+def _drain() -> None:
+    while flush():
+        pass
+
+
+def flush(batch_size: int = BATCH_SIZE) -> int:
+    """Process one batch of the queue; returns how many entries it cleared.
+
+    Rows are locked with SKIP LOCKED, so several workers can flush at once.
+    Keys whose original is referenced again, or that another deployment may
+    share, leave the queue without being deleted. Keys whose content is
+    being retained right now stay queued. Keys that fail to delete are
+    retried with backoff, so they don't hold up the rest of the queue.
+    """
+    now = datetime.now(timezone.utc)
+    locked: list[str] = []
+    try:
+        with db.atomic():
+            batch = list(PendingDeletion
+                         .select()
+                         .where(PendingDeletion.retry_at.is_null() | (PendingDeletion.retry_at <= now))
+                         .order_by(PendingDeletion.id)
+                         .limit(batch_size)
+                         .for_update("FOR UPDATE SKIP LOCKED"))
+            # Session locks: held past this transaction, through the delete
+            for identity in dict.fromkeys(_identity(row.original) for row in batch):
+                if _lock(identity, wait=False, session=True):
+                    locked.append(identity)
+            batch = [row for row in batch if _identity(row.original) in locked]
+            originals = {row.original for row in batch}
+            used = _referenced(originals) if originals else set()
+            used |= {f for f in originals if not storage.owned(f)}
+            kept = [row.id for row in batch if row.original in used]
+            if kept:
+                PendingDeletion.delete().where(PendingDeletion.id.in_(kept)).execute()
+        doomed = [row for row in batch if row.original not in used]
+        failed = set(storage.delete_many([row.key for row in doomed])) if doomed else set()
+        done = [row.id for row in doomed if row.key not in failed]
+        if done:
+            PendingDeletion.delete().where(PendingDeletion.id.in_(done)).execute()
+        for row in doomed:
+            if row.key in failed:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** row.attempts)
+                (PendingDeletion
+                 .update(attempts=PendingDeletion.attempts + 1, retry_at=now + timedelta(seconds=delay))
+                 .where(PendingDeletion.id == row.id)
+                 .execute())
+        return len(kept) + len(done)
+    finally:
+        for identity in locked:
+            db.execute_sql("SELECT pg_advisory_unlock(%s, hashtext(%s))", (LOCK_SPACE, identity))
+
+
+def sweep(min_age: float = ORPHAN_MIN_AGE) -> int:
+    """Queue stored objects that no row references; returns how many."""
+    if not storage.scoped():
+        raise RuntimeError("sweep() needs STORAGE_PREFIX; it would queue the whole bucket")
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age)
+    stored = list(storage.list_objects())
+    live = {Path(f).stem for f in PostImage.select(PostImage.filename).scalars()}
+    live |= {Path(f).stem for f in Profile.select(Profile.avatar_filename)
+             .where(Profile.avatar_filename.is_null(False)).scalars()}
+    # A variant is queued under its original, so retain() and the reference
+    # check see it; or under itself if the original is gone
+    originals = {Path(key).stem: key for key, _ in stored if not _VARIANT.fullmatch(key)}
+    orphans = [{"key": key, "original": originals.get(_identity(key), key)}
+               for key, modified in stored
+               if modified <= cutoff   # younger ones may be uploads still being confirmed
+               and _identity(key) not in live]
+    _enqueue(orphans)
+    return len(orphans)
+
+
+def _run() -> None:
+    next_sweep = time.monotonic() + SWEEP_INTERVAL
+    while not _stop.is_set():
+        with _dirty_lock:
+            dirty = list(_dirty)
+            _dirty.clear()
+        sweeping = time.monotonic() >= next_sweep
+        if sweeping:
+            next_sweep = time.monotonic() + SWEEP_INTERVAL
+        try:
+            tenants = _tenants() if sweeping or not POOLED else dirty
+        except Exception as e:   # database hiccup; retry next round
+            print(f"Deletion worker: {e}")
+            tenants = dirty
+        for tenant in tenants:
+            try:
+                with tenant_context(tenant), db.connection_context():
+                    _drain()
+                    if sweeping and sweep():
+                        _drain()
+            except Exception as e:   # storage or database hiccup; retry next round
+                print(f"Deletion worker: {e}")
+                if tenant is not None:
+                    with _dirty_lock:
+                        _dirty.add(tenant)
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+
+
+def start() -> None:
+    global _thread
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="deletions", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    _stop.set()
+    _wake.set()
+    if _thread is not None:
+        _thread.join(timeout=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Flush the deletion queue once.")
+    parser.add_argument("--sweep", action="store_true", help="queue unreferenced objects first")
+    args = parser.parse_args()
+
+    queued = cleared = 0
+    for tenant in _tenants():
+        with tenant_context(tenant), db.connection_context():
+            if args.sweep:
+                queued += sweep()
+            while n := flush():
+                cleared += n
+    if args.sweep:
+        print(f"queued {queued} orphaned object(s)")
+    print(f"done: {cleared} queued object(s) processed")
+
+
+if __name__ == "__main__":
+    main()
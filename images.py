@@ -0,0 +1,140 @@
+import base64
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+
+from PIL import Image, ImageOps
+
+import storage
+
+VARIANT_WIDTHS = (320, 640, 1280)
+WEBP_QUALITY   = 80
+IMAGE_WORKERS  = int(os.getenv("IMAGE_WORKERS", "1"))
+
+PLACEHOLDER_SIZE = 16     # longest edge of the inline LQIP, in px
+_CHUNK           = 1024 * 1024
+_EXIF_ORIENTATION = 0x0112
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def variant_filename(filename: str, width: int) -> str:
+    return f"{Path(filename).stem}_{width}w.webp"
+
+
+def stored_filenames(filename: str, widths: list[int]) -> list[str]:
+    """The original object plus every derivative generated from it."""
+    return [filename] + [variant_filename(filename, w) for w in widths]
+
+
+def variant_fields(filename: str | None, widths: list[int]) -> tuple[list[dict], str | None]:
+    """(variants, srcset) for the API. Both are empty until derivatives exist,
+    so clients fall back to the original URL while generation is pending."""
+    if not filename or not widths:
+        return [], None
+    variants = [{"width": w, "url": storage.public_url(variant_filename(filename, w))}
+                for w in sorted(widths)]
+    return variants, ", ".join(f"{v['url']} {v['width']}w" for v in variants)
+
+
+# Leading bytes of each accepted format -> (content type, extension)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+)
+SNIFF_BYTES = 12
+
+
+def sniff(head: bytes) -> tuple[str, str] | None:
+    """(content type, extension) of an image from its first SNIFF_BYTES bytes,
+    or None if it is not a format we accept."""
+    for magic, content_type, ext in _SIGNATURES:
+        if head.startswith(magic):
+            return content_type, ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    return None
+
+
+def describe(file: BinaryIO) -> dict:
+    """Intrinsic metadata of an original upload, computed once and stored with it.
+
+    Reads `file` from the start and rewinds it afterwards. Dimensions and the
+    placeholder are None if Pillow cannot decode the file.
+    """
+    file.seek(0)
+    digest, size = hashlib.sha256(), 0
+    while chunk := file.read(_CHUNK):
+        digest.update(chunk)
+        size += len(chunk)
+    meta = {"width": None, "height": None, "byte_size": size,
+            "content_hash": digest.hexdigest(), "placeholder": None}
+    file.seek(0)
+    try:
+        with Image.open(file) as im:
+            width, height = im.size
+            if im.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width   # displayed rotated by 90°
+            meta["width"], meta["height"] = width, height
+            # JPEG can decode straight at a reduced scale, which is all the LQIP needs
+            im.draft("RGB", (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+            im = ImageOps.exif_transpose(im)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "A" in im.getbands() or im.mode == "P" else "RGB")
+            im.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            buf = io.BytesIO()
+            im.save(buf, "WEBP", quality=30)
+            meta["placeholder"] = "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode()
+    except OSError:
+        pass
+    file.seek(0)
+    return meta
+
+
+def _render(data: bytes, widths: tuple[int, ...]) -> dict[int, bytes]:
+    """Resize and re-encode one image. Runs in a worker process."""
+    with Image.open(io.BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+        out = {}
+        for width in widths:
+            if width >= im.width:
+                continue   # never upscale; the original already covers this size
+            height = max(1, round(im.height * width / im.width))
+            buf = io.BytesIO()
+            im.resize((width, height), Image.LANCZOS).save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+            out[width] = buf.getvalue()
+        return out
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the web process runs threads (upload pool, DB), which fork does not copy safely
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def make_variants(filename: str) -> list[int]:
+    """Generate and store the WebP derivatives of an uploaded original.
+
+    Blocks until done, so call it from a background task. Returns the widths
+    that were stored, which is empty for originals narrower than the smallest
+    variant.
+    """
+    try:
+        rendered = _get_pool().submit(_render, storage.read(filename), VARIANT_WIDTHS).result()
+    except OSError as e:
+        # Not decodable by Pillow; keep serving the original
+        print(f"Variant generation failed for {filename}: {e}")
+        return []
+    for width, data in rendered.items():
+        storage.put(variant_filename(filename, width), data, "image/webp")
+    return sorted(rendered)
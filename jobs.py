@@ -0,0 +1,166 @@
+"""Durable background jobs, stored in Postgres.
+
+Web handlers only enqueue(). A separate worker process claims jobs with
+FOR UPDATE SKIP LOCKED, so any number of workers can share the table, and
+runs up to WORKER_CONCURRENCY of them at once:
+
+    python jobs.py [--concurrency 4]
+
+A claimed job stays hidden for VISIBILITY_TIMEOUT. It runs under that same
+timeout, so if its worker dies the job becomes claimable again rather than
+being lost. Failed attempts are retried with backoff. After max_attempts,
+the job is dead-lettered (status "dead", with its last error) for someone
+to look at. Handlers must therefore be idempotent. Each attempt's timing is
+stored on the row and logged.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import signal
+import time
+
+import provisioning
+from database import db
+from provisioning.models import Job
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "900"))   # s
+POLL_INTERVAL      = float(os.getenv("JOB_POLL_INTERVAL", "1"))          # s, when the queue is empty
+RETRY_BASE_DELAY   = float(os.getenv("JOB_RETRY_BASE_DELAY", "30"))      # s, doubled per attempt
+RETRY_MAX_DELAY    = 3600                                                # s
+
+# kind -> async handler taking the payload as keyword arguments
+HANDLERS = {
+    "provision":   provisioning.provision,
+    "deprovision": provisioning.deprovision,
+}
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = 5) -> Job:
+    """Queue a job. Call inside a connection context (or the transaction
+    whose commit should publish it)."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    return Job.create(kind=kind, payload=payload, max_attempts=max_attempts)
+
+
+def claim() -> Job | None:
+    """Take the oldest visible job, or None if there is nothing to do.
+
+    Jobs that have used up their attempts (their last worker died) are
+    dead-lettered here instead of being handed out again.
+    """
+    with db.connection_context():
+        while True:
+            with db.atomic():
+                job = (Job
+                       .select()
+                       .where(Job.status.in_(["queued", "running"]), Job.visible_at <= _now())
+                       .order_by(Job.visible_at)
+                       .limit(1)
+                       .for_update("FOR UPDATE SKIP LOCKED")
+                       .first())
+                if job is None:
+                    return None
+                if job.attempts >= job.max_attempts:
+                    job.status = "dead"
+                    job.last_error = job.last_error or "visibility timeout expired on the last attempt"
+                    job.save()
+                    print(f"Job {job.id} ({job.kind}) dead-lettered: {job.last_error}")
+                    continue
+                job.status = "running"
+                job.attempts += 1
+                job.started_at = _now()
+                job.visible_at = job.started_at + datetime.timedelta(seconds=VISIBILITY_TIMEOUT)
+                job.save()
+                return job
+
+
+def _complete(job: Job, duration: float) -> None:
+    with db.connection_context():
+        (Job
+         .update(status="done", finished_at=_now(), duration=duration, last_error=None)
+         .where(Job.id == job.id, Job.attempts == job.attempts)   # not if re-claimed meanwhile
+         .execute())
+
+
+def _fail(job: Job, duration: float, error: str) -> str:
+    if job.attempts >= job.max_attempts:
+        status, visible_at = "dead", job.visible_at
+    else:
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+        status, visible_at = "queued", _now() + datetime.timedelta(seconds=delay)
+    with db.connection_context():
+        (Job
+         .update(status=status, visible_at=visible_at, finished_at=_now(),
+                 duration=duration, last_error=error)
+         .where(Job.id == job.id, Job.attempts == job.attempts)
+         .execute())
+    return status
+
+
+async def run(job: Job) -> None:
+    """Run one claimed job and record the outcome."""
+    waited = (job.started_at - job.created_at).total_seconds()
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(HANDLERS[job.kind](**job.payload), VISIBILITY_TIMEOUT)
+    except Exception as e:
+        duration = time.monotonic() - start
+        error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        status = await asyncio.to_thread(_fail, job, duration, error)
+        print(f"Job {job.id} ({job.kind}) attempt {job.attempts} failed after {duration:.1f}s, "
+              f"{'dead-lettered' if status == 'dead' else 'will retry'}: {error}")
+        return
+    duration = time.monotonic() - start
+    await asyncio.to_thread(_complete, job, duration)
+    print(f"Job {job.id} ({job.kind}) done in {duration:.1f}s (queued {waited:.1f}s)")
+
+
+async def work(concurrency: int = WORKER_CONCURRENCY, stop: asyncio.Event | None = None) -> None:
+    """Claim and run jobs until `stop` is set, at most `concurrency` at a
+    time. Jobs in progress are finished before returning."""
+    stop = stop or asyncio.Event()
+
+    async def worker() -> None:
+        while not stop.is_set():
+            try:
+                job = await asyncio.to_thread(claim)
+            except Exception as e:   # database hiccup; try again shortly
+                print(f"Job worker: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(stop.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await run(job)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the background job worker.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    async def serve() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        print(f"Job worker started ({args.concurrency} concurrent)")
+        await work(args.concurrency, stop)
+        print("Job worker stopped")
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
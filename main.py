@@ -1,36 +1,49 @@
 from pathlib import Path
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request
 
-from database import db
-from models import Profile, Post, PostImage, Tag, PostTag
-from provisioning.models import Customer
-from routers import auth, profile, posts, checkout, health
+import deletions
+import migrations
+from assets import ImmutableStaticFiles, PrecompressedStaticFiles, built
+from database import POOLED, db
+from responses import APICompressionMiddleware
+from routers import auth, profile, posts, checkout, health, uploads
+from shell import html_page, spa_shell
+from tenancy import CONTROL_MODELS, TENANT_MODELS, TenantMiddleware, host_slug
 
 STATIC_DIR    = Path(__file__).parent / "static"
 UPLOAD_DIR    = STATIC_DIR / "uploads"
-FRONTEND_DIR  = Path(__file__).parent / "public"
-MARKETING_DIR = Path(__file__).parent / "marketing"
+FRONTEND_DIR  = built(Path(__file__).parent / "public")
+MARKETING_DIR = built(Path(__file__).parent / "marketing")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     db.connect(reuse_if_open=True)
-    db.create_tables([Profile, Post, PostImage, Tag, PostTag, Customer], safe=True)
+    if POOLED:
+        # Hubs' tables live in their own schemas (tenancy.create_schema)
+        db.create_tables(CONTROL_MODELS, safe=True)
+        migrations.upgrade(migrations.CONTROL_UPGRADES)
+    else:
+        db.create_tables(TENANT_MODELS + CONTROL_MODELS, safe=True)
+        migrations.upgrade()
     db.close()
     UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    deletions.start()
     yield
+    deletions.stop()
 
 
 app = FastAPI(title="Crimata", lifespan=lifespan)
+app.add_middleware(APICompressionMiddleware)
+if POOLED:
+    app.add_middleware(TenantMiddleware)   # outermost, so everything below sees the tenant
 
 # 1. Static file mounts (must come before catch-all)
-app.mount("/uploads",   StaticFiles(directory=str(UPLOAD_DIR)),    name="uploads")
-app.mount("/assets",    StaticFiles(directory=str(FRONTEND_DIR)),  name="public-assets")
-app.mount("/marketing", StaticFiles(directory=str(MARKETING_DIR)), name="marketing")
+app.mount("/uploads",   ImmutableStaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+app.mount("/assets",    PrecompressedStaticFiles(directory=FRONTEND_DIR),  name="public-assets")
+app.mount("/marketing", PrecompressedStaticFiles(directory=MARKETING_DIR), name="marketing")
 
 # 2. API routers
 app.include_router(health.router)
@@ -38,19 +51,24 @@ app.include_router(auth.router)
 app.include_router(profile.router)
 app.include_router(posts.router)
 app.include_router(checkout.router)
+app.include_router(uploads.router)
 
 
-# 3. Marketing routes
+# 3. Marketing routes, and a hub's public profile
 @app.get("/", include_in_schema=False)
-async def homepage():
-    return FileResponse(str(MARKETING_DIR / "index.html"))
+def homepage(request: Request):
+    # The root domain is the marketing site; on a hub's own host "/" is its
+    # public profile. sync: rendering the bootstrap may query the database
+    if host_slug(request.headers.get("host", "")) == "":
+        return html_page(request, MARKETING_DIR / "index.html")
+    return spa_shell(request, FRONTEND_DIR / "index.html", "/")
 
 @app.get("/success", include_in_schema=False)
-async def success():
-    return FileResponse(str(MARKETING_DIR / "success.html"))
+async def success(request: Request):
+    return html_page(request, MARKETING_DIR / "success.html")
 
 
 # 4. SPA catch-all — MUST be last
 @app.get("/{full_path:path}", include_in_schema=False)
-async def spa_fallback(full_path: str):
-    return FileResponse(str(FRONTEND_DIR / "index.html"))
+async def spa_fallback(full_path: str, request: Request):
+    return spa_shell(request, FRONTEND_DIR / "index.html", full_path)
@@ -0,0 +1,135 @@
+from database import db
+
+# create_tables(safe=True) only creates missing tables and indexes. Columns
+# added to an existing table need an explicit, idempotent ALTER here.
+
+
+def _unless(exists: str, *statements: str) -> str:
+    """Run `statements` only while the `exists` query returns no row, so a
+    normal restart takes no lock on hot tables. A changed trigger or index
+    needs a new name (or an explicit DROP) to be picked up."""
+    body = ";\n".join(statements)
+    return f"DO $$ BEGIN IF NOT EXISTS ({exists}) THEN\n{body};\nEND IF; END $$"
+
+
+def _column(table: str, column: str) -> str:
+    return (f"SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+            f"AND table_name = '{table}' AND column_name = '{column}'")
+
+
+def _trigger(table: str, name: str) -> str:
+    return f"SELECT 1 FROM pg_trigger WHERE tgrelid = '{table}'::regclass AND tgname = '{name}'"
+
+
+def _index(name: str) -> str:
+    return f"SELECT 1 WHERE to_regclass('{name}') IS NOT NULL"
+
+
+# A hub's own tables (in pooled mode, run in each tenant's schema)
+TENANT_UPGRADES = [
+    "ALTER TABLE post_images ADD COLUMN IF NOT EXISTS variants JSON NOT NULL DEFAULT '[]'",
+    "ALTER TABLE profile ADD COLUMN IF NOT EXISTS avatar_variants JSON NOT NULL DEFAULT '[]'",
+    "ALTER TABLE post_images ADD COLUMN IF NOT EXISTS width INTEGER",
+    "ALTER TABLE post_images ADD COLUMN IF NOT EXISTS height INTEGER",
+    "ALTER TABLE post_images ADD COLUMN IF NOT EXISTS byte_size INTEGER",
+    "ALTER TABLE post_images ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE post_images ADD COLUMN IF NOT EXISTS placeholder TEXT",
+    "ALTER TABLE profile ADD COLUMN IF NOT EXISTS avatar_width INTEGER",
+    "ALTER TABLE profile ADD COLUMN IF NOT EXISTS avatar_height INTEGER",
+    "ALTER TABLE profile ADD COLUMN IF NOT EXISTS avatar_byte_size INTEGER",
+    "ALTER TABLE profile ADD COLUMN IF NOT EXISTS avatar_content_hash VARCHAR(64)",
+    "ALTER TABLE profile ADD COLUMN IF NOT EXISTS avatar_placeholder TEXT",
+
+    # Full-text search: posts.search_vector covers tag names (weight A),
+    # caption (B) and location (C). Triggers keep it current when a post is
+    # written and when its post_tags rows change.
+    _unless(_column("posts", "search_vector"), "ALTER TABLE posts ADD COLUMN search_vector TSVECTOR"),
+    """
+    CREATE OR REPLACE FUNCTION posts_search_vector(p_id INTEGER, p_caption TEXT, p_location TEXT)
+    RETURNS TSVECTOR LANGUAGE sql STABLE AS $$
+        SELECT setweight(to_tsvector('english', coalesce(
+                   (SELECT string_agg(t.name, ' ') FROM post_tags pt
+                    JOIN tags t ON t.id = pt.tag_id WHERE pt.post_id = p_id), '')), 'A')
+            || setweight(to_tsvector('english', coalesce(p_caption, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(p_location, '')), 'C')
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION posts_search_vector_row() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.search_vector := posts_search_vector(NEW.id, NEW.caption, NEW.location);
+        RETURN NEW;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION posts_search_vector_tags() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE posts SET search_vector = posts_search_vector(id, caption, location)
+         WHERE id IN (SELECT DISTINCT post_id FROM changed);
+        RETURN NULL;
+    END
+    $$
+    """,
+    # Posts written before the row trigger existed are backfilled with it
+    _unless(_trigger("posts", "posts_search_vector_row"), """
+    CREATE TRIGGER posts_search_vector_row BEFORE INSERT OR UPDATE ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_search_vector_row()
+    """, "UPDATE posts SET search_vector = posts_search_vector(id, caption, location) WHERE search_vector IS NULL"),
+    _unless(_trigger("post_tags", "post_tags_search_vector_insert"), """
+    CREATE TRIGGER post_tags_search_vector_insert AFTER INSERT ON post_tags
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION posts_search_vector_tags()
+    """),
+    _unless(_trigger("post_tags", "post_tags_search_vector_delete"), """
+    CREATE TRIGGER post_tags_search_vector_delete AFTER DELETE ON post_tags
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION posts_search_vector_tags()
+    """),
+    _unless(_index("posts_search_vector"), "CREATE INDEX posts_search_vector ON posts USING GIN (search_vector)"),
+
+    # Denormalized tag ids for multi-tag filters and tag counts, backfilled
+    # when the column is added
+    _unless(_column("posts", "tag_ids"), "ALTER TABLE posts ADD COLUMN tag_ids INTEGER[] NOT NULL DEFAULT '{}'", """
+    UPDATE posts p SET tag_ids = sub.ids
+      FROM (SELECT post_id, array_agg(tag_id ORDER BY tag_id) AS ids
+              FROM post_tags GROUP BY post_id) sub
+     WHERE sub.post_id = p.id
+    """),
+    _unless(_index("posts_tag_ids"), "CREATE INDEX posts_tag_ids ON posts USING GIN (tag_ids)"),
+
+    # deletions.retain cancels queued deletions by original
+    _unless(_index("pending_deletions_original"),
+            "CREATE INDEX pending_deletions_original ON pending_deletions (original)"),
+
+    # Back-off for keys whose delete keeps failing
+    _unless(_column("pending_deletions", "attempts"),
+            "ALTER TABLE pending_deletions ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE pending_deletions ADD COLUMN retry_at TIMESTAMP"),
+]
+
+# Customers, listeners and jobs (in pooled mode, the public schema only)
+CONTROL_UPGRADES = [
+    # Resumable provisioning
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS secret_key VARCHAR(255)",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS completed_steps VARCHAR(255)[] NOT NULL DEFAULT '{}'",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS provision_error TEXT",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS provision_lease_until TIMESTAMP",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS target_group_arn VARCHAR(255)",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS task_definition_arn VARCHAR(255)",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS listener_rule_arn VARCHAR(255)",
+
+    # Listener pool
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS listener_id INTEGER REFERENCES listeners (id)",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS listener_priority INTEGER",
+    "CREATE INDEX IF NOT EXISTS customers_listener_id ON customers (listener_id)",
+]
+
+
+UPGRADES = TENANT_UPGRADES + CONTROL_UPGRADES
+
+
+def upgrade(statements: list[str] = UPGRADES) -> None:
+    with db.atomic():
+        for statement in statements:
+            db.execute_sql(statement)
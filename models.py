@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
 from peewee import (Model, AutoField, CharField, TextField, BooleanField,
                     DateTimeField, IntegerField, ForeignKeyField, CompositeKey)
-from playhouse.postgres_ext import JSONField
+from playhouse.postgres_ext import ArrayField, JSONField, TSVectorField
 from database import db
 
 
@@ -15,6 +15,12 @@ class Profile(BaseModel):
     name = CharField(max_length=100, default='')
     bio = TextField(default='')
     avatar_filename = CharField(max_length=255, null=True)
+    avatar_variants = JSONField(default=list)   # widths of generated WebP derivatives
+    avatar_width = IntegerField(null=True)
+    avatar_height = IntegerField(null=True)
+    avatar_byte_size = IntegerField(null=True)
+    avatar_content_hash = CharField(max_length=64, null=True)   # sha256 hex
+    avatar_placeholder = TextField(null=True)                   # inline LQIP data URI
     links = JSONField(default=list)
 
     class Meta:
@@ -27,16 +33,33 @@ class Post(BaseModel):
     location = CharField(max_length=255, null=True)
     published = BooleanField(default=False)
     created_at = DateTimeField(default=lambda: datetime.now(timezone.utc))
+    # Maintained by database triggers over caption, location and tag names
+    # (see migrations.py), which also own its GIN index.
+    search_vector = TSVectorField(null=True, index=False)
+    # Denormalized copy of this post's PostTag ids, written alongside them by the
+    # posts router; GIN-indexed in migrations.py for tag filters and facets.
+    tag_ids = ArrayField(IntegerField, default=list, index=False)
 
     class Meta:
         table_name = 'posts'
+        indexes = (
+            # Keyset pagination: (created_at, id) ordering, optionally published-only
+            (('published', 'created_at', 'id'), False),
+            (('created_at', 'id'), False),
+        )
 
 
 class PostImage(BaseModel):
     id = AutoField()
     post = ForeignKeyField(Post, on_delete='CASCADE', column_name='post_id')
-    filename = CharField(max_length=255)
+    filename = CharField(max_length=255, index=True)   # content-addressed; rows may share one
     order = IntegerField(default=0)
+    variants = JSONField(default=list)   # widths of generated WebP derivatives
+    width = IntegerField(null=True)
+    height = IntegerField(null=True)
+    byte_size = IntegerField(null=True)
+    content_hash = CharField(max_length=64, null=True)   # sha256 hex
+    placeholder = TextField(null=True)                   # inline LQIP data URI
 
     class Meta:
         table_name = 'post_images'
@@ -57,3 +80,30 @@ class PostTag(BaseModel):
     class Meta:
         table_name = 'post_tags'
         primary_key = CompositeKey('post', 'tag')
+        indexes = (
+            (('tag', 'post'), False),
+        )
+
+
+class Revision(BaseModel):
+    """Single-row content revision, bumped on every owner write (drives ETag / Last-Modified)."""
+    id = IntegerField(primary_key=True, default=1)
+    value = IntegerField(default=0)
+    updated_at = DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+    class Meta:
+        table_name = 'revision'
+
+
+class PendingDeletion(BaseModel):
+    """Stored object queued for deletion, written in the transaction that dropped
+    its last reference. deletions.py re-checks `original` before deleting."""
+    id = AutoField()
+    key = CharField(max_length=255, unique=True)   # object to delete
+    original = CharField(max_length=255)           # filename whose rows would keep it alive
+    created_at = DateTimeField(default=lambda: datetime.now(timezone.utc))
+    attempts = IntegerField(default=0)             # failed deletes so far
+    retry_at = DateTimeField(null=True)            # not flushed again before this
+
+    class Meta:
+        table_name = 'pending_deletions'
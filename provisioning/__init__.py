@@ -1,71 +1,319 @@
+"""Customer provisioning, run as a small state machine.
+
+Each step in STEPS is idempotent and waits only for the steps it depends
+on, so independent ones (the database, DNS, the target group, the task
+definition) run concurrently. When a step finishes, its name and any
+resource ids it created are recorded on the Customer. A failed run marks
+the customer `failed`; running it again skips the recorded steps and
+resumes where it stopped. Transient AWS and Postgres errors are retried
+with exponential backoff first.
+
+In pooled tenancy (tenancy.py) the shared fleet, its listener rule and the
+wildcard DNS record already serve every hub, so provisioning only creates
+the hub's schema and sends the welcome email.
+
+A run holds the customer for LEASE_SECONDS; once that lapses (the process
+died or the job timed out) the next attempt takes over. To resume by hand:
+
+    python -m provisioning resume <stripe_customer_id> [--force]
+"""
+import asyncio
+import datetime
+import os
+import random
 import re
 import secrets
-import asyncio
+import time
+
+import psycopg2
+from botocore.exceptions import ClientError, ConnectionError as AWSConnectionError, HTTPClientError
+from peewee import JOIN, IntegrityError, PeeweeException, fn
+
+import tenancy
+from database import POOLED, db
+from .models import Customer, Listener
+from . import db_setup, compute, dns, listeners, notify
+
+RETRY_ATTEMPTS   = int(os.getenv("PROVISION_RETRY_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("PROVISION_RETRY_BASE_DELAY", "1"))   # s, doubled per attempt
+RETRY_MAX_DELAY  = 30                                                     # s
+
+# How long a run may hold a customer before another may take over. Keep it
+# below the job worker's visibility timeout, so a retried job can resume.
+LEASE_SECONDS    = float(os.getenv("PROVISION_LEASE_SECONDS", "600"))
+
+# How often a signup may lose its slug to a concurrent one before giving up
+SLUG_ATTEMPTS    = 5
+
+# AWS error codes worth retrying, besides any 5xx
+TRANSIENT_AWS_ERRORS = {
+    "Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException",
+    "ServiceUnavailable", "InternalError", "InternalFailure", "ServerException",
+    "PriorRequestNotComplete",   # Route53: previous change still pending
+}
+
+# Postgres SQLSTATEs worth retrying (prefixes): connection exceptions,
+# serialization failures and deadlocks, resource limits, server restarts
+TRANSIENT_PG_CODES = ("08", "40001", "40P01", "53", "57P01", "57P02", "57P03")
+
+# Errors while connecting carry no SQLSTATE. Those the server sent (FATAL),
+# such as a bad password or a missing database, are final except these.
+TRANSIENT_PG_FATALS = ("too many clients", "too many connections", "starting up", "shutting down",
+                       "in recovery mode")
+
+
+# ── Steps ─────────────────────────────────────────────────────────────────────
+# Each takes the Customer and may return fields to store on it.
+
+def _create_database(customer: Customer) -> None:
+    db_setup.create_database(customer.db_name, customer.db_password)
+
+
+def _create_schema(customer: Customer) -> None:
+    tenancy.create_schema(customer)
+
+
+def _assign_listener(customer: Customer) -> dict:
+    with db.connection_context():
+        listener, priority = listeners.assign(customer.id)
+    return {"listener": listener, "listener_priority": priority}
+
+
+def _create_dns_record(customer: Customer) -> None:
+    dns.create_record(customer.slug, customer.listener.alb_dns_name, customer.listener.alb_zone_id)
+
+
+def _create_target_group(customer: Customer) -> dict:
+    return {"target_group_arn": compute.create_target_group(customer.slug)}
+
+
+def _register_task_definition(customer: Customer) -> dict:
+    return {"task_definition_arn": compute.register_task_definition(
+        customer.slug, customer.db_name, customer.db_password, customer.secret_key, customer.passphrase)}
+
+
+def _add_listener_rule(customer: Customer) -> dict:
+    return {"listener_rule_arn": compute.add_listener_rule(
+        customer.slug, customer.target_group_arn, customer.listener.arn, customer.listener_priority)}
 
-from .models import Customer
-from . import db_setup, compute, dns, notify
 
+def _create_service(customer: Customer) -> None:
+    compute.create_ecs_service(customer.slug, customer.task_definition_arn, customer.target_group_arn)
+
+
+def _send_welcome(customer: Customer) -> None:
+    notify.send_welcome(customer.email, customer.slug, customer.passphrase)
+
+
+# name -> (steps it waits for, step)
+DEDICATED_STEPS = {
+    "database":        ((), _create_database),
+    "listener":        ((), _assign_listener),
+    "dns":             (("listener",), _create_dns_record),
+    "target_group":    ((), _create_target_group),
+    "task_definition": ((), _register_task_definition),
+    "listener_rule":   (("target_group", "listener"), _add_listener_rule),
+    "service":         (("database", "task_definition", "listener_rule"), _create_service),
+    "welcome":         (("service", "dns"), _send_welcome),
+}
+
+POOLED_STEPS = {
+    "schema":          ((), _create_schema),
+    "welcome":         (("schema",), _send_welcome),
+}
+
+STEPS = POOLED_STEPS if POOLED else DEDICATED_STEPS
+
+
+# ── Orchestration ─────────────────────────────────────────────────────────────
 
 async def provision(stripe_customer_id: str, subscription_id: str, email: str) -> None:
-    """Orchestrate full customer provisioning. Called from Stripe webhook background task."""
+    """Provision a new customer, or resume a failed run for an existing one.
+    Runs as a "provision" job (jobs.py), queued by the Stripe webhook."""
+    customer = await asyncio.to_thread(_claim, stripe_customer_id, subscription_id, email)
+    if customer is not None:
+        await _run(customer)
 
-    # Idempotency — don't double-provision if Stripe retries the webhook
-    if Customer.select().where(Customer.stripe_customer_id == stripe_customer_id).exists():
-        return
 
-    slug        = _unique_slug(email)
-    db_name     = f"crimata_{slug.replace('-', '_')}"
-    db_password = secrets.token_urlsafe(24)
-    secret_key  = secrets.token_hex(32)
-    passphrase  = secrets.token_urlsafe(12)
+async def resume(stripe_customer_id: str, force: bool = False) -> bool:
+    """Resume a failed provision, or one whose run died (its lease expired).
+    With `force`, take over a run even while its lease lasts. Returns False
+    if there was nothing to resume."""
+    customer = await asyncio.to_thread(_claim_existing, stripe_customer_id, force)
+    if customer is None:
+        return False
+    await _run(customer)
+    return True
+
+
+def _claim(stripe_customer_id: str, subscription_id: str, email: str) -> Customer | None:
+    with db.connection_context():
+        if Customer.select().where(Customer.stripe_customer_id == stripe_customer_id).exists():
+            # A retried job or webhook; pick up where an earlier run stopped
+            return _claim_existing(stripe_customer_id)
+        for attempt in range(SLUG_ATTEMPTS):
+            slug = _unique_slug(email)
+            try:
+                return Customer.create(
+                    stripe_customer_id=stripe_customer_id,
+                    stripe_subscription_id=subscription_id,
+                    email=email,
+                    slug=slug,
+                    db_name=tenancy.schema_name(slug) if POOLED else f"crimata_{slug.replace('-', '_')}",
+                    db_password=secrets.token_urlsafe(24),
+                    passphrase=secrets.token_urlsafe(12),
+                    secret_key=secrets.token_hex(32),
+                    status="provisioning",
+                    provision_lease_until=_lease(),
+                )
+            except IntegrityError:
+                if Customer.select().where(Customer.stripe_customer_id == stripe_customer_id).exists():
+                    return None   # a concurrent delivery of the same event won
+                if attempt == SLUG_ATTEMPTS - 1:
+                    raise
+                # Another signup took the slug meanwhile; pick the next free one
+
+
+def _lease() -> datetime.datetime:
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=LEASE_SECONDS)
+
 
-    customer = Customer.create(
-        stripe_customer_id=stripe_customer_id,
-        stripe_subscription_id=subscription_id,
-        email=email,
-        slug=slug,
-        db_name=db_name,
-        db_password=db_password,
-        passphrase=passphrase,
-        status="provisioning",
-    )
+def _claim_existing(stripe_customer_id: str, force: bool = False) -> Customer | None:
+    """Take over a failed run, or one whose lease expired. The conditional
+    update makes sure only one caller gets to run it."""
+    with db.connection_context():
+        stalled = (Customer.status == "provisioning")
+        if not force:
+            stalled &= (Customer.provision_lease_until.is_null()
+                        | (Customer.provision_lease_until < datetime.datetime.utcnow()))
+        claimed = (Customer
+                   .update(status="provisioning", provision_error=None, provision_lease_until=_lease())
+                   .where(Customer.stripe_customer_id == stripe_customer_id,
+                          (Customer.status == "failed") | stalled)
+                   .execute())
+        if not claimed:
+            return None
+        customer = _with_listener(Customer.stripe_customer_id == stripe_customer_id)
+        if customer.secret_key is None:   # failed before secret keys were stored
+            customer.secret_key = secrets.token_hex(32)
+            customer.save(only=[Customer.secret_key])
+        return customer
 
-    try:
-        # 1. Create Postgres database on shared RDS
-        await asyncio.to_thread(db_setup.create_database, db_name, db_password)
 
-        # 2. Spin up ECS Fargate service + ALB routing
-        await asyncio.to_thread(compute.create_service, slug, db_name, db_password, secret_key, passphrase)
+async def _run(customer: Customer) -> None:
+    done = set(customer.completed_steps)
+    tasks: dict[str, asyncio.Future] = {}
 
-        # 3. Create Route53 subdomain record
-        await asyncio.to_thread(dns.create_record, slug)
+    async def run_step(name: str) -> None:
+        after, step = STEPS[name]
+        await asyncio.gather(*(tasks[dep] for dep in after))
+        if name in done:
+            return
+        start = time.monotonic()
+        fields = await _with_retries(name, step, customer) or {}
+        for field, value in fields.items():
+            setattr(customer, field, value)
+        await asyncio.to_thread(_record_step, customer.id, name, fields)
+        print(f"Provisioning {customer.slug}: {name} done in {time.monotonic() - start:.1f}s")
 
-        # 4. Send welcome email via SES
-        await asyncio.to_thread(notify.send_welcome, email, slug, passphrase)
+    start = time.monotonic()
+    for name in STEPS:
+        tasks[name] = asyncio.ensure_future(run_step(name))
+    # Let independent steps finish even if one fails, so a resume redoes less
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        error = errors[0]   # steps downstream of a failure re-raise the same error
+        await asyncio.to_thread(_finish, customer.id, "failed", f"{type(error).__name__}: {error}")
+        print(f"Provisioning failed for {customer.email}: {error}")
+        raise error
+    await asyncio.to_thread(_finish, customer.id, "active", None)
+    print(f"Provisioned {customer.slug} in {time.monotonic() - start:.1f}s")
 
-        customer.status = "active"
-        customer.save()
 
-    except Exception as e:
-        customer.status = "failed"
-        customer.save()
-        print(f"Provisioning failed for {email}: {e}")
-        raise
+async def _with_retries(name: str, step, customer: Customer):
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        try:
+            return await asyncio.to_thread(step, customer)
+        except Exception as e:
+            if attempt == RETRY_ATTEMPTS or not _is_transient(e):
+                raise
+            # Full jitter keeps concurrent signups from retrying in lockstep
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            print(f"Provisioning {customer.slug}: {name} failed ({e}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return error.response.get("Error", {}).get("Code") in TRANSIENT_AWS_ERRORS or status >= 500
+    if isinstance(error, PeeweeException) and error.args and isinstance(error.args[0], psycopg2.Error):
+        error = error.args[0]   # peewee wraps the driver's error
+    if isinstance(error, psycopg2.Error):
+        if error.pgcode is not None:
+            return error.pgcode.startswith(TRANSIENT_PG_CODES)
+        message = str(error)
+        return isinstance(error, psycopg2.OperationalError) and (
+            "FATAL:" not in message or any(s in message for s in TRANSIENT_PG_FATALS))
+    return isinstance(error, (AWSConnectionError, HTTPClientError))
+
+
+def _record_step(customer_id: int, name: str, fields: dict) -> None:
+    # array_append in SQL, so concurrent steps don't overwrite each other
+    with db.connection_context():
+        (Customer
+         .update(completed_steps=fn.array_append(Customer.completed_steps, name), **fields)
+         .where(Customer.id == customer_id)
+         .execute())
+
+
+def _finish(customer_id: int, status: str, error: str | None) -> None:
+    with db.connection_context():
+        (Customer
+         .update(status=status, provision_error=error, provision_lease_until=None)
+         .where(Customer.id == customer_id)
+         .execute())
 
 
 async def deprovision(stripe_customer_id: str) -> None:
     """Tear down all resources for a cancelled customer."""
-    try:
-        customer = Customer.get(Customer.stripe_customer_id == stripe_customer_id)
-    except Customer.DoesNotExist:
+    customer = await asyncio.to_thread(_cancel, stripe_customer_id)
+    if customer is None:
         return
 
-    customer.status = "cancelled"
-    customer.save()
-
-    await asyncio.to_thread(compute.delete_service, customer.slug, None)
+    if POOLED:
+        await asyncio.to_thread(tenancy.drop_schema, customer)
+        return
+    await asyncio.to_thread(compute.delete_service, customer.slug, customer.target_group_arn,
+                            customer.listener_rule_arn, customer.task_definition_arn)
     await asyncio.to_thread(db_setup.drop_database, customer.db_name)
-    await asyncio.to_thread(dns.delete_record, customer.slug)
+    if customer.listener is not None:
+        await asyncio.to_thread(dns.delete_record, customer.slug,
+                                customer.listener.alb_dns_name, customer.listener.alb_zone_id)
+    else:
+        await asyncio.to_thread(dns.delete_record, customer.slug)
+    await asyncio.to_thread(_release_listener, customer.id)
+
+
+def _with_listener(*where) -> Customer | None:
+    # Joined, so steps can use customer.listener without a query of their own
+    return (Customer
+            .select(Customer, Listener)
+            .join(Listener, JOIN.LEFT_OUTER)
+            .where(*where)
+            .get_or_none())
+
+
+def _cancel(stripe_customer_id: str) -> Customer | None:
+    with db.connection_context():
+        Customer.update(status="cancelled").where(Customer.stripe_customer_id == stripe_customer_id).execute()
+        return _with_listener(Customer.stripe_customer_id == stripe_customer_id)
+
+
+def _release_listener(customer_id: int) -> None:
+    with db.connection_context():
+        listeners.release(customer_id)
 
 
 def _unique_slug(email: str) -> str:
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+
+from database import db
+from . import listeners, resume
+from .models import Listener
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m provisioning",
+                                     description="Provisioning maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    resume_cmd = commands.add_parser("resume", help="resume a customer's failed provisioning")
+    resume_cmd.add_argument("stripe_customer_id")
+    resume_cmd.add_argument("--force", action="store_true",
+                            help="take over a run even if its lease has not expired")
+
+    pool = commands.add_parser("listeners", help="manage the ALB listener pool")
+    pool_commands = pool.add_subparsers(dest="pool_command", required=True)
+    add = pool_commands.add_parser("add", help="add a listener to the pool")
+    add.add_argument("arn")
+    add.add_argument("alb_dns_name")
+    add.add_argument("alb_zone_id")
+    add.add_argument("--rule-limit", type=int, default=listeners.RULE_LIMIT)
+    drain = pool_commands.add_parser("drain", help="stop assigning new tenants to a listener")
+    drain.add_argument("arn")
+    pool_commands.add_parser("list", help="show the pool")
+    args = parser.parse_args()
+
+    if args.command == "resume":
+        if not asyncio.run(resume(args.stripe_customer_id, force=args.force)):
+            raise SystemExit("nothing to resume (see the customer's status)")
+        print("done")
+        return
+
+    with db.connection_context():
+        if args.pool_command == "add":
+            listener = listeners.register(args.arn, args.alb_dns_name, args.alb_zone_id, args.rule_limit)
+            print(f"added listener {listener.id} ({listener.tenants} existing rules)")
+        elif args.pool_command == "drain":
+            if not listeners.drain(args.arn):
+                raise SystemExit(f"no listener {args.arn}")
+        else:
+            listeners.seed()
+            for l in Listener.select().order_by(Listener.id):
+                state = "accepting" if l.accepting else "draining"
+                print(f"{l.id:>3}  {l.tenants:>4}/{l.rule_limit:<4} {state:<9}  {l.arn}  -> {l.alb_dns_name}")
+
+
+if __name__ == "__main__":
+    main()
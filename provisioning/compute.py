@@ -1,16 +1,18 @@
 import os
 import boto3
+from botocore.exceptions import ClientError
 
 AWS_REGION          = os.getenv("AWS_REGION", "us-east-1")
 ECS_CLUSTER         = os.getenv("ECS_CLUSTER")
 ECR_IMAGE           = os.getenv("ECR_IMAGE")
 VPC_SUBNETS         = os.getenv("VPC_SUBNETS", "").split(",")
 SECURITY_GROUP      = os.getenv("SECURITY_GROUP")
-ALB_LISTENER_ARN    = os.getenv("ALB_LISTENER_ARN")
+ALB_LISTENER_ARN    = os.getenv("ALB_LISTENER_ARN")   # first listener of the pool (provisioning.listeners)
 VPC_ID              = os.getenv("VPC_ID")
 TASK_EXECUTION_ROLE = os.getenv("TASK_EXECUTION_ROLE_ARN")
 RDS_HOST            = os.getenv("RDS_HOST")
 RDS_PORT            = os.getenv("RDS_PORT", "5432")
+RDS_REPLICA_HOST    = os.getenv("RDS_REPLICA_HOST")  # optional read replica; roles replicate with the data
 
 ecs    = boto3.client("ecs",    region_name=AWS_REGION)
 elbv2  = boto3.client("elbv2",  region_name=AWS_REGION)
@@ -19,49 +21,12 @@ logs   = boto3.client("logs",   region_name=AWS_REGION)
 LOG_GROUP = "/crimata/customers"
 
 
-def create_service(slug: str, db_name: str, db_password: str, secret_key: str, passphrase: str) -> str:
-    """Spin up a Fargate service for a customer. Returns the target group ARN."""
-    _ensure_log_group()
-    target_group_arn = _create_target_group(slug)
-    task_def_arn     = _register_task_definition(slug, db_name, db_password, secret_key, passphrase)
-    _create_ecs_service(slug, task_def_arn, target_group_arn)
-    _add_alb_listener_rule(slug, target_group_arn)
-    return target_group_arn
-
-
-def delete_service(slug: str, target_group_arn: str) -> None:
-    """Tear down a customer's ECS service and ALB resources (used on cancellation)."""
-    # Scale down and delete ECS service
-    try:
-        ecs.update_service(cluster=ECS_CLUSTER, service=f"crimata-{slug}", desiredCount=0)
-        ecs.delete_service(cluster=ECS_CLUSTER, service=f"crimata-{slug}")
-    except ecs.exceptions.ServiceNotFoundException:
-        pass
-
-    # Remove ALB listener rules pointing to this target group
-    rules = elbv2.describe_rules(ListenerArn=ALB_LISTENER_ARN)["Rules"]
-    for rule in rules:
-        for action in rule.get("Actions", []):
-            if action.get("TargetGroupArn") == target_group_arn:
-                elbv2.delete_rule(RuleArn=rule["RuleArn"])
-
-    # Delete target group
-    try:
-        elbv2.delete_target_group(TargetGroupArn=target_group_arn)
-    except Exception:
-        pass
-
-
-# --- helpers ---
-
-def _ensure_log_group() -> None:
-    try:
-        logs.create_log_group(logGroupName=LOG_GROUP)
-    except logs.exceptions.ResourceAlreadyExistsException:
-        pass
+# Provisioning steps (see provisioning.STEPS). Each is safe to re-run after a
+# partial failure; the ARNs they return are stored on the Customer.
 
-
-def _create_target_group(slug: str) -> str:
+def create_target_group(slug: str) -> str:
+    """Target group for the customer's tasks. Returns its ARN; re-creating
+    one with the same name and settings returns the existing group."""
     resp = elbv2.create_target_group(
         Name=f"crimata-{slug}"[:32],
         Protocol="HTTP",
@@ -75,8 +40,21 @@ def _create_target_group(slug: str) -> str:
     return resp["TargetGroups"][0]["TargetGroupArn"]
 
 
-def _register_task_definition(slug: str, db_name: str, db_password: str, secret_key: str, passphrase: str) -> str:
+def register_task_definition(slug: str, db_name: str, db_password: str, secret_key: str, passphrase: str) -> str:
+    """Register the customer's task definition. Returns its ARN."""
+    _ensure_log_group()
     database_url = f"postgresql://{db_name}:{db_password}@{RDS_HOST}:{RDS_PORT}/{db_name}"
+    environment = [
+        {"name": "DATABASE_URL",  "value": database_url},
+        {"name": "SECRET_KEY",    "value": secret_key},
+        {"name": "PASSPHRASE",    "value": passphrase},
+        {"name": "STORAGE_PREFIX", "value": slug},
+    ]
+    if RDS_REPLICA_HOST:
+        environment.append({
+            "name": "DATABASE_REPLICA_URL",
+            "value": f"postgresql://{db_name}:{db_password}@{RDS_REPLICA_HOST}:{RDS_PORT}/{db_name}",
+        })
     resp = ecs.register_task_definition(
         family=f"crimata-{slug}",
         networkMode="awsvpc",
@@ -88,11 +66,7 @@ def _register_task_definition(slug: str, db_name: str, db_password: str, secret_
             "name": "crimata",
             "image": ECR_IMAGE,
             "portMappings": [{"containerPort": 8000, "protocol": "tcp"}],
-            "environment": [
-                {"name": "DATABASE_URL",  "value": database_url},
-                {"name": "SECRET_KEY",    "value": secret_key},
-                {"name": "PASSPHRASE",    "value": passphrase},
-            ],
+            "environment": environment,
             "logConfiguration": {
                 "logDriver": "awslogs",
                 "options": {
@@ -106,7 +80,37 @@ def _register_task_definition(slug: str, db_name: str, db_password: str, secret_
     return resp["taskDefinition"]["taskDefinitionArn"]
 
 
-def _create_ecs_service(slug: str, task_def_arn: str, target_group_arn: str) -> None:
+def add_listener_rule(slug: str, target_group_arn: str, listener_arn: str, priority: int) -> str:
+    """Route {slug}.crimata.com to the target group at the priority the
+    listener pool allocated (provisioning.listeners). Returns the rule ARN."""
+    host = f"{slug}.crimata.com"
+    try:
+        resp = elbv2.create_rule(
+            ListenerArn=listener_arn,
+            Priority=priority,
+            Conditions=[{"Field": "host-header", "Values": [host]}],
+            Actions=[{"Type": "forward", "TargetGroupArn": target_group_arn}],
+        )
+    except ClientError as e:
+        # The priority is ours alone, so it is taken by an earlier attempt's
+        # rule, whose ARN was never recorded. Only this path lists rules.
+        if e.response["Error"]["Code"] != "PriorityInUse":
+            raise
+        rule = _find_rule(listener_arn, host)
+        if rule is None:
+            raise
+        return rule["RuleArn"]
+    return resp["Rules"][0]["RuleArn"]
+
+
+def create_ecs_service(slug: str, task_def_arn: str, target_group_arn: str) -> None:
+    """Start the customer's Fargate service, unless it is already running.
+
+    The target group must already be attached to the ALB (add_listener_rule).
+    """
+    services = ecs.describe_services(cluster=ECS_CLUSTER, services=[f"crimata-{slug}"])["services"]
+    if any(s["status"] == "ACTIVE" for s in services):
+        return
     ecs.create_service(
         cluster=ECS_CLUSTER,
         serviceName=f"crimata-{slug}",
@@ -128,15 +132,57 @@ def _create_ecs_service(slug: str, task_def_arn: str, target_group_arn: str) ->
     )
 
 
-def _add_alb_listener_rule(slug: str, target_group_arn: str) -> None:
-    # Use existing rule count to pick a priority (offset from 100 to leave room below)
-    existing = elbv2.describe_rules(ListenerArn=ALB_LISTENER_ARN)["Rules"]
-    priorities = [int(r["Priority"]) for r in existing if r["Priority"] != "default"]
-    priority = max(priorities, default=99) + 1
+def delete_service(slug: str, target_group_arn: str | None, rule_arn: str | None,
+                   task_definition_arn: str | None) -> None:
+    """Tear down a customer's ECS service and ALB resources (used on
+    cancellation), addressing each by its stored ARN. Missing ones (never
+    created, or already deleted) are skipped, so a failed run can be
+    retried."""
+    try:
+        ecs.delete_service(cluster=ECS_CLUSTER, service=f"crimata-{slug}", force=True)
+    except (ecs.exceptions.ServiceNotFoundException, ecs.exceptions.ServiceNotActiveException):
+        pass
 
-    elbv2.create_rule(
-        ListenerArn=ALB_LISTENER_ARN,
-        Priority=priority,
-        Conditions=[{"Field": "host-header", "Values": [f"{slug}.crimata.com"]}],
-        Actions=[{"Type": "forward", "TargetGroupArn": target_group_arn}],
-    )
+    if rule_arn is None:
+        # Provisioned before rule ARNs were stored; it lives on the original listener
+        rule = _find_rule(ALB_LISTENER_ARN, f"{slug}.crimata.com")
+        rule_arn = rule and rule["RuleArn"]
+    if rule_arn is not None:
+        try:
+            elbv2.delete_rule(RuleArn=rule_arn)
+        except elbv2.exceptions.RuleNotFoundException:
+            pass
+
+    if task_definition_arn is not None:
+        try:
+            ecs.deregister_task_definition(taskDefinition=task_definition_arn)
+        except ecs.exceptions.ClientException:
+            # Deregistering twice fails; an earlier attempt may have done it
+            status = ecs.describe_task_definition(taskDefinition=task_definition_arn)["taskDefinition"]["status"]
+            if status == "ACTIVE":
+                raise
+
+    # Fails (ResourceInUse) while ECS is still draining the service's tasks
+    # from it; the error fails the deprovision job, whose retry tries again
+    if target_group_arn is not None:
+        try:
+            elbv2.delete_target_group(TargetGroupArn=target_group_arn)
+        except elbv2.exceptions.TargetGroupNotFoundException:
+            pass
+
+
+# --- helpers ---
+
+def _find_rule(listener_arn: str, host: str) -> dict | None:
+    for rule in elbv2.describe_rules(ListenerArn=listener_arn)["Rules"]:
+        for condition in rule.get("Conditions", []):
+            if condition.get("Field") == "host-header" and host in condition.get("Values", []):
+                return rule
+    return None
+
+
+def _ensure_log_group() -> None:
+    try:
+        logs.create_log_group(logGroupName=LOG_GROUP)
+    except logs.exceptions.ResourceAlreadyExistsException:
+        pass
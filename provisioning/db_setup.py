@@ -6,9 +6,18 @@ RDS_PORT     = int(os.getenv("RDS_PORT", "5432"))
 RDS_MASTER_USER = os.getenv("RDS_MASTER_USER")
 RDS_MASTER_PASSWORD = os.getenv("RDS_MASTER_PASSWORD")
 
+# Hard cap on connections per tenant role, enforced by Postgres across every
+# container of the tenant. Leaves headroom over the app's DB_POOL_MAX_CONNECTIONS
+# for a rolling deploy where old and new tasks overlap.
+TENANT_CONNECTION_LIMIT = int(os.getenv("TENANT_CONNECTION_LIMIT", "10"))
+
 
 def create_database(db_name: str, db_password: str) -> None:
-    """Create a Postgres database and dedicated user on the shared RDS instance."""
+    """Create a Postgres database and dedicated user on the shared RDS instance.
+
+    Safe to re-run: whatever a previous, interrupted attempt already created
+    is left in place (the user's password and limit are reset).
+    """
     conn = psycopg2.connect(
         host=RDS_HOST, port=RDS_PORT,
         user=RDS_MASTER_USER, password=RDS_MASTER_PASSWORD,
@@ -16,8 +25,13 @@ def create_database(db_name: str, db_password: str) -> None:
     )
     conn.autocommit = True
     with conn.cursor() as cur:
-        cur.execute(f'CREATE DATABASE "{db_name}"')
-        cur.execute(f'CREATE USER "{db_name}" WITH PASSWORD %s', (db_password,))
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (db_name,))
+        if cur.fetchone() is None:
+            cur.execute(f'CREATE DATABASE "{db_name}"')
+        cur.execute("SELECT 1 FROM pg_roles WHERE rolname = %s", (db_name,))
+        verb = "ALTER" if cur.fetchone() else "CREATE"
+        cur.execute(f'{verb} USER "{db_name}" WITH PASSWORD %s CONNECTION LIMIT %s',
+                    (db_password, TENANT_CONNECTION_LIMIT))
         cur.execute(f'GRANT ALL PRIVILEGES ON DATABASE "{db_name}" TO "{db_name}"')
     conn.close()
 
@@ -9,40 +9,43 @@ ALB_ZONE_ID    = os.getenv("ALB_ZONE_ID")  # ALB's hosted zone ID (not your Rout
 route53 = boto3.client("route53", region_name=AWS_REGION)
 
 
-def create_record(slug: str) -> None:
-    """Create a Route53 alias record: {slug}.crimata.com → ALB."""
-    route53.change_resource_record_sets(
-        HostedZoneId=HOSTED_ZONE_ID,
-        ChangeBatch={
-            "Changes": [{
-                "Action": "CREATE",
-                "ResourceRecordSet": {
-                    "Name": f"{slug}.crimata.com",
-                    "Type": "A",
-                    "AliasTarget": {
-                        "HostedZoneId":         ALB_ZONE_ID,
-                        "DNSName":              ALB_DNS_NAME,
-                        "EvaluateTargetHealth": True,
-                    },
-                },
-            }],
-        },
-    )
+def create_record(slug: str, alb_dns_name: str = ALB_DNS_NAME, alb_zone_id: str = ALB_ZONE_ID) -> None:
+    """Create a Route53 alias record: {slug}.crimata.com → the ALB of the
+    tenant's listener (provisioning.listeners). Idempotent."""
+    _change("UPSERT", slug, alb_dns_name, alb_zone_id)
+
+
+def delete_record(slug: str, alb_dns_name: str = ALB_DNS_NAME, alb_zone_id: str = ALB_ZONE_ID) -> None:
+    """Remove the Route53 record for a cancelled customer. The alias target
+    must match the record's, so pass the same ALB it was created with. A
+    record that is already gone counts as deleted."""
+    try:
+        _change("DELETE", slug, alb_dns_name, alb_zone_id)
+    except route53.exceptions.InvalidChangeBatch:
+        if _exists(slug):
+            raise
+
+
+def _exists(slug: str) -> bool:
+    name = f"{slug}.crimata.com."
+    records = route53.list_resource_record_sets(
+        HostedZoneId=HOSTED_ZONE_ID, StartRecordName=name, StartRecordType="A", MaxItems="1",
+    )["ResourceRecordSets"]
+    return bool(records) and records[0]["Name"] == name and records[0]["Type"] == "A"
 
 
-def delete_record(slug: str) -> None:
-    """Remove the Route53 record for a cancelled customer."""
+def _change(action: str, slug: str, alb_dns_name: str, alb_zone_id: str) -> None:
     route53.change_resource_record_sets(
         HostedZoneId=HOSTED_ZONE_ID,
         ChangeBatch={
             "Changes": [{
-                "Action": "DELETE",
+                "Action": action,
                 "ResourceRecordSet": {
                     "Name": f"{slug}.crimata.com",
                     "Type": "A",
                     "AliasTarget": {
-                        "HostedZoneId":         ALB_ZONE_ID,
-                        "DNSName":              ALB_DNS_NAME,
+                        "HostedZoneId":         alb_zone_id,
+                        "DNSName":              alb_dns_name,
                         "EvaluateTargetHealth": True,
                     },
                 },
@@ -0,0 +1,118 @@
+"""Pool of ALB listeners that tenants are spread across.
+
+AWS caps the rules per listener (and the target groups per ALB), so a
+single listener caps how many tenants we can host. Each new tenant goes to
+the accepting listener with the fewest tenants. Its rule priority is the
+lowest one that no other customer on that listener holds, which is read
+from the customers table instead of listing the listener's rules. Its
+subdomain gets a Route53 alias to that listener's ALB.
+
+The pool starts out with the ALB_LISTENER_ARN listener, and the customers
+its rules already route. To manage it:
+
+    python -m provisioning listeners add <listener-arn> <alb-dns-name> <alb-zone-id> [--rule-limit 100]
+    python -m provisioning listeners drain <listener-arn>
+    python -m provisioning listeners list
+"""
+import itertools
+import os
+
+from peewee import IntegrityError
+
+from database import db
+from .models import Customer, Listener
+from . import compute, dns
+
+RULE_LIMIT = int(os.getenv("ALB_RULE_LIMIT", "100"))   # per listener, excluding the default rule
+
+
+class PoolFull(RuntimeError):
+    pass
+
+
+def drain(arn: str) -> bool:
+    """Stop assigning new tenants to a listener; its current ones stay."""
+    return bool(Listener.update(accepting=False).where(Listener.arn == arn).execute())
+
+
+def register(arn: str, alb_dns_name: str, alb_zone_id: str, rule_limit: int = RULE_LIMIT) -> Listener:
+    """Add a listener to the pool. Rules it already has count against its
+    limit, and allocated priorities start above them; this is the only time
+    a listener's rules are listed. Customers whose subdomain a rule routes,
+    and that have no listener yet (provisioned before the pool existed), are
+    assigned to it, so release() gives their slots back."""
+    rules = [r for r in compute.elbv2.describe_rules(ListenerArn=arn)["Rules"] if r["Priority"] != "default"]
+    priorities = [int(r["Priority"]) for r in rules]
+    listener = Listener.create(
+        arn=arn, alb_dns_name=alb_dns_name, alb_zone_id=alb_zone_id, rule_limit=rule_limit,
+        tenants=len(priorities), first_priority=max(priorities, default=0) + 1,
+    )
+    for rule in rules:
+        for slug in _rule_slugs(rule):
+            (Customer
+             .update(listener=listener.id, listener_priority=int(rule["Priority"]))
+             .where(Customer.slug == slug, Customer.listener.is_null())
+             .execute())
+    return listener
+
+
+def _rule_slugs(rule: dict) -> list[str]:
+    suffix = ".crimata.com"
+    return [host[:-len(suffix)]
+            for condition in rule.get("Conditions", []) if condition.get("Field") == "host-header"
+            for host in condition.get("Values", []) if host.endswith(suffix)]
+
+
+def seed() -> None:
+    # The listener configured before the pool existed
+    if compute.ALB_LISTENER_ARN and not Listener.select().exists():
+        try:
+            with db.atomic():
+                register(compute.ALB_LISTENER_ARN, dns.ALB_DNS_NAME, dns.ALB_ZONE_ID)
+        except IntegrityError:   # a concurrent signup seeded it first
+            pass
+
+
+def assign(customer_id: int) -> tuple[Listener, int]:
+    """Pick the customer's listener and rule priority, unless it already
+    has them. Call inside a connection context."""
+    seed()
+    with db.atomic():
+        customer = Customer.select().where(Customer.id == customer_id).for_update().get()
+        if customer.listener_id is not None:
+            return Listener.get_by_id(customer.listener_id), customer.listener_priority
+        # The row lock serializes allocations on this listener
+        listener = (Listener
+                    .select()
+                    .where(Listener.accepting, Listener.tenants < Listener.rule_limit)
+                    .order_by(Listener.tenants, Listener.id)
+                    .limit(1)
+                    .for_update()
+                    .first())
+        if listener is None:
+            raise PoolFull("Every ALB listener is full; add one with `python -m provisioning listeners add`")
+        used = set(Customer
+                   .select(Customer.listener_priority)
+                   .where(Customer.listener == listener.id)
+                   .scalars())
+        priority = next(p for p in itertools.count(listener.first_priority) if p not in used)
+        Listener.update(tenants=Listener.tenants + 1).where(Listener.id == listener.id).execute()
+        (Customer
+         .update(listener=listener.id, listener_priority=priority)
+         .where(Customer.id == customer_id)
+         .execute())
+        return listener, priority
+
+
+def release(customer_id: int) -> None:
+    """Give the customer's slot back once its rule is gone. Call inside a
+    connection context."""
+    with db.atomic():
+        customer = Customer.select().where(Customer.id == customer_id).for_update().get()
+        if customer.listener_id is None:
+            return
+        Listener.update(tenants=Listener.tenants - 1).where(Listener.id == customer.listener_id).execute()
+        (Customer
+         .update(listener=None, listener_priority=None)
+         .where(Customer.id == customer_id)
+         .execute())
@@ -1,8 +1,28 @@
 import datetime
-from peewee import Model, CharField, DateTimeField
+from peewee import (Model, AutoField, BooleanField, CharField, DateTimeField, FloatField,
+                    ForeignKeyField, IntegerField, TextField)
+from playhouse.postgres_ext import ArrayField, JSONField
 from database import db
 
 
+class Listener(Model):
+    """An ALB listener tenants can be routed through (provisioning.listeners).
+    Each ALB caps its listener rules and target groups, so new tenants are
+    spread over a pool of them."""
+    id                   = AutoField()
+    arn                  = CharField(unique=True)
+    alb_dns_name         = CharField()              # Route53 alias target for its tenants
+    alb_zone_id          = CharField()              # the ALB's hosted zone ID
+    rule_limit           = IntegerField(default=100)
+    tenants              = IntegerField(default=0)  # rules in use, including ones made outside the pool
+    first_priority       = IntegerField(default=1)  # rules below this were not allocated by us
+    accepting            = BooleanField(default=True)  # False: draining, gets no new tenants
+
+    class Meta:
+        database = db
+        table_name = "listeners"
+
+
 class Customer(Model):
     stripe_customer_id   = CharField(unique=True)
     stripe_subscription_id = CharField(unique=True)
@@ -11,9 +31,44 @@ class Customer(Model):
     db_name              = CharField(unique=True)
     db_password          = CharField()              # password for customer's RDS user
     passphrase           = CharField()              # initial login passphrase
+    secret_key           = CharField(null=True)     # tenant's SECRET_KEY, kept so a resumed run reuses it
     status               = CharField(default="provisioning")  # provisioning | active | failed | cancelled
     created_at           = DateTimeField(default=datetime.datetime.utcnow)
 
+    # Provisioning progress (see provisioning.STEPS), so a failed run can resume
+    completed_steps      = ArrayField(CharField, default=list, index=False)
+    provision_error      = TextField(null=True)     # last step failure, cleared on success
+    provision_lease_until = DateTimeField(null=True)  # a run past this is presumed dead
+    target_group_arn     = CharField(null=True)
+    task_definition_arn  = CharField(null=True)
+    listener_rule_arn    = CharField(null=True)
+    listener             = ForeignKeyField(Listener, null=True, column_name="listener_id", index=False)
+    listener_priority    = IntegerField(null=True)
+
     class Meta:
         database = db
         table_name = "customers"
+
+
+class Job(Model):
+    """Unit of background work for the worker (jobs.py). A job is claimable
+    while queued or running once `visible_at` has passed: claiming sets it
+    running and hides it for the visibility timeout, so work whose worker
+    died becomes claimable again."""
+    id                   = AutoField()
+    kind                 = CharField()                # key into jobs.HANDLERS
+    payload              = JSONField(default=dict)    # handler keyword arguments
+    status               = CharField(default="queued")  # queued | running | done | dead
+    attempts             = IntegerField(default=0)
+    max_attempts         = IntegerField(default=5)
+    visible_at           = DateTimeField(default=datetime.datetime.utcnow)
+    last_error           = TextField(null=True)
+    created_at           = DateTimeField(default=datetime.datetime.utcnow)
+    started_at           = DateTimeField(null=True)   # last claim
+    finished_at          = DateTimeField(null=True)
+    duration             = FloatField(null=True)      # s, last attempt
+
+    class Meta:
+        database = db
+        table_name = "jobs"
+        indexes = ((("status", "visible_at"), False),)
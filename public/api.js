@@ -21,6 +21,30 @@ export async function api(path, opts = {}) {
   return res
 }
 
+// Data the server embedded in the page for the first render. Handed out once;
+// later renders fetch fresh data.
+export function takeBootstrap() {
+  const el = document.getElementById('bootstrap')
+  if (!el) return null
+  el.remove()
+  return JSON.parse(el.textContent)
+}
+
+// Direct uploads: the API signs a PUT per file, the browser sends the bytes
+// straight to storage, then the keys are confirmed with the API.
+// Files are stored under their SHA-256, so identical uploads share one object.
+export async function uploadSpec(file) {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+  const sha256 = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('')
+  return { filename: file.name, content_type: file.type, size: file.size, sha256 }
+}
+
+export async function putUpload(target, file) {
+  if (!target.url) return   // already stored
+  const res = await fetch(target.url, { method: target.method, headers: target.headers, body: file })
+  if (!res.ok) throw new Error(`Upload failed (${res.status})`)
+}
+
 export function imgUrl(url) {
   return url || null
 }
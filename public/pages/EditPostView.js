@@ -1,6 +1,6 @@
 import { ref, reactive, onMounted } from 'vue'
 import { useRoute, useRouter } from 'vue-router'
-import { api, imgUrl } from '../api.js'
+import { api, imgUrl, uploadSpec, putUpload } from '../api.js'
 
 export default {
   setup() {
@@ -52,12 +52,21 @@ export default {
       const files = e.target.files
       if (!files.length) return
       uploadingImages.value = true
-      const fd = new FormData()
-      for (const f of files) fd.append('files', f)
-      const res = await api(`/posts/${post.value.id}/images`, { method: 'POST', body: fd })
-      post.value = await res.json()
-      uploadingImages.value = false
-      e.target.value = ''
+      try {
+        const base = `/posts/${post.value.id}/images`
+        const presigned = await api(`${base}/presign`, {
+          method: 'POST', body: JSON.stringify({ files: await Promise.all(Array.from(files, uploadSpec)) })
+        })
+        const targets = await presigned.json()
+        await Promise.all(targets.map((t, i) => putUpload(t, files[i])))
+        const res = await api(`${base}/confirm`, {
+          method: 'POST', body: JSON.stringify({ keys: targets.map(t => t.key) })
+        })
+        post.value = await res.json()
+      } finally {
+        uploadingImages.value = false
+        e.target.value = ''
+      }
     }
 
     async function deleteImage(imgId) {
@@ -130,7 +139,7 @@ export default {
           <h2 style="font-size:16px; font-weight:700; margin-bottom:16px;">Images</h2>
           <div class="image-grid" v-if="post.images.length">
             <div v-for="(img, i) in post.images" :key="img.id" class="image-item">
-              <img :src="imgUrl(img.url)" :alt="'Image ' + (i+1)" />
+              <img :src="imgUrl(img.url)" :srcset="img.srcset" sizes="160px" :alt="'Image ' + (i+1)" />
               <span class="img-order">{{ i + 1 }}</span>
               <div class="img-actions">
                 <button class="btn btn-secondary btn-sm" @click="moveImage(img.id, -1)" :disabled="i === 0">←</button>
@@ -1,5 +1,5 @@
 import { ref, reactive, onMounted } from 'vue'
-import { api, imgUrl } from '../api.js'
+import { api, imgUrl, uploadSpec, putUpload } from '../api.js'
 
 export default {
   setup() {
@@ -47,12 +47,16 @@ export default {
       const file = e.target.files[0]
       if (!file) return
       uploadingAvatar.value = true
-      const fd = new FormData()
-      fd.append('file', file)
-      const res = await api('/profile/avatar', { method: 'POST', body: fd })
-      profile.value = await res.json()
-      uploadingAvatar.value = false
-      e.target.value = ''
+      try {
+        const presigned = await api('/profile/avatar/presign', { method: 'POST', body: JSON.stringify(await uploadSpec(file)) })
+        const target = await presigned.json()
+        await putUpload(target, file)
+        const res = await api('/profile/avatar/confirm', { method: 'POST', body: JSON.stringify({ key: target.key }) })
+        profile.value = await res.json()
+      } finally {
+        uploadingAvatar.value = false
+        e.target.value = ''
+      }
     }
 
     onMounted(load)
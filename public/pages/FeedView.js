@@ -5,12 +5,22 @@ import { api, imgUrl, formatDate } from '../api.js'
 export default {
   setup() {
     const posts = ref([])
+    const nextCursor = ref(null)
     const creating = ref(false)
     const router = useRouter()
 
     async function load() {
       const res = await api('/posts/feed/all')
-      posts.value = await res.json()
+      const page = await res.json()
+      posts.value = page.items
+      nextCursor.value = page.next_cursor
+    }
+
+    async function loadMore() {
+      const res = await api(`/posts/feed/all?cursor=${encodeURIComponent(nextCursor.value)}`)
+      const page = await res.json()
+      posts.value = posts.value.concat(page.items)
+      nextCursor.value = page.next_cursor
     }
 
     async function createPost() {
@@ -32,7 +42,7 @@ export default {
 
     onMounted(load)
 
-    return { posts, creating, createPost, deletePost, imgUrl, formatDate }
+    return { posts, nextCursor, creating, loadMore, createPost, deletePost, imgUrl, formatDate }
   },
   template: `
     <div>
@@ -50,7 +60,7 @@ export default {
 
         <div v-for="post in posts" :key="post.id" class="card post-card">
           <div class="post-card-inner">
-            <img v-if="post.images.length" :src="imgUrl(post.images[0].url)" class="post-card-thumb" :alt="post.caption" />
+            <img v-if="post.images.length" :src="imgUrl(post.images[0].url)" :srcset="post.images[0].srcset" sizes="80px" class="post-card-thumb" :alt="post.caption" />
             <div v-else class="post-card-thumb-empty">📷</div>
             <div class="post-card-info">
               <div class="post-card-caption">{{ post.caption || '(no caption)' }}</div>
@@ -66,6 +76,10 @@ export default {
             </div>
           </div>
         </div>
+
+        <div v-if="nextCursor" style="text-align:center; margin-top:16px;">
+          <button class="btn btn-secondary" @click="loadMore">Load more</button>
+        </div>
       </div>
     </div>
   `
@@ -1,23 +1,60 @@
 import { ref, onMounted, onUnmounted } from 'vue'
-import { api, imgUrl, formatDate } from '../api.js'
+import { api, imgUrl, formatDate, takeBootstrap } from '../api.js'
 
 export default {
   setup() {
     const profile = ref(null)
     const posts = ref([])
+    const nextCursor = ref(null)
     const activePost = ref(null)
     const carouselIndex = ref(0)
     const filterTag = ref(null)
+    const searchQuery = ref('')
+    const tagCounts = ref([])
 
     console.log("PUBLIC")
 
+    function postsPath(cursor) {
+      const params = new URLSearchParams()
+      const q = searchQuery.value.trim()
+      if (q) params.set('q', q)
+      else if (filterTag.value) params.set('tag', filterTag.value)
+      if (cursor) params.set('cursor', cursor)
+      const qs = params.toString()
+      return (q ? '/posts/search' : '/posts') + (qs ? `?${qs}` : '')
+    }
+
+    function show(profileData, page, tags) {
+      profile.value = profileData
+      tagCounts.value = tags
+      posts.value = page.items
+      nextCursor.value = page.next_cursor
+    }
+
     async function load() {
-      const [pRes, postsRes] = await Promise.all([
+      const [pRes, postsRes, tagsRes] = await Promise.all([
         api('/profile'),
-        api('/posts' + (filterTag.value ? `?tag=${encodeURIComponent(filterTag.value)}` : ''))
+        api(postsPath()),
+        api('/posts/tags')
       ])
-      profile.value = await pRes.json()
-      posts.value = await postsRes.json()
+      show(await pRes.json(), await postsRes.json(), await tagsRes.json())
+    }
+
+    function hydrate() {
+      const boot = takeBootstrap()
+      if (boot) show(boot.profile, boot.posts, boot.tags)
+      else load()
+    }
+
+    async function loadMore() {
+      const res = await api(postsPath(nextCursor.value))
+      const page = await res.json()
+      posts.value = posts.value.concat(page.items)
+      nextCursor.value = page.next_cursor
+    }
+
+    function placeholderStyle(img) {
+      return img.placeholder ? { backgroundImage: `url(${img.placeholder})`, backgroundSize: 'cover' } : null
     }
 
     function openPost(post) { activePost.value = post; carouselIndex.value = 0 }
@@ -35,8 +72,9 @@ export default {
       carouselIndex.value = (carouselIndex.value + 1) % len
     }
 
-    function filterByTag(name) { filterTag.value = name; load() }
+    function filterByTag(name) { searchQuery.value = ''; filterTag.value = name; load() }
     function clearFilter() { filterTag.value = null; load() }
+    function search() { filterTag.value = null; load() }
 
     function handleKey(e) {
       if (!activePost.value) return
@@ -45,17 +83,17 @@ export default {
       if (e.key === 'Escape') closePost()
     }
 
-    onMounted(() => { load(); document.addEventListener('keydown', handleKey) })
+    onMounted(() => { hydrate(); document.addEventListener('keydown', handleKey) })
     onUnmounted(() => { document.removeEventListener('keydown', handleKey) })
 
-    return { profile, posts, activePost, carouselIndex, filterTag, openPost, closePost, prevImage, nextImage, filterByTag, clearFilter, imgUrl, formatDate }
+    return { profile, posts, nextCursor, loadMore, activePost, carouselIndex, filterTag, searchQuery, tagCounts, search, openPost, closePost, prevImage, nextImage, filterByTag, clearFilter, placeholderStyle, imgUrl, formatDate }
   },
   template: `
     <div>
       <nav-bar />
       <div class="page" v-if="profile">
         <div class="profile-header">
-          <img v-if="profile.avatar_url" :src="imgUrl(profile.avatar_url)" class="profile-avatar" alt="Avatar" />
+          <img v-if="profile.avatar_url" :src="imgUrl(profile.avatar_url)" :srcset="profile.avatar_srcset" sizes="150px" class="profile-avatar" alt="Avatar" />
           <div v-else class="profile-avatar-placeholder">👤</div>
           <div class="profile-info">
             <h1>{{ profile.name || 'No name set' }}</h1>
@@ -66,6 +104,14 @@ export default {
           </div>
         </div>
 
+        <form @submit.prevent="search" style="margin-bottom:16px;">
+          <input type="text" v-model="searchQuery" placeholder="Search posts" />
+        </form>
+
+        <div v-if="tagCounts.length && !filterTag" class="modal-tags" style="margin-bottom:16px;">
+          <span v-for="tag in tagCounts" :key="tag.id" class="tag-chip" @click="filterByTag(tag.name)">#{{ tag.name }} ({{ tag.count }})</span>
+        </div>
+
         <div v-if="filterTag" style="margin-bottom:16px; display:flex; align-items:center; gap:8px;">
           <span>Filtering by tag: <strong>#{{ filterTag }}</strong></span>
           <button class="btn btn-secondary btn-sm" @click="clearFilter">Clear</button>
@@ -73,12 +119,15 @@ export default {
 
         <div class="post-grid" v-if="posts.length">
           <div v-for="post in posts" :key="post.id" class="post-thumb" @click="openPost(post)">
-            <img v-if="post.images.length" :src="imgUrl(post.images[0].url)" :alt="post.caption" />
+            <img v-if="post.images.length" :src="imgUrl(post.images[0].url)" :srcset="post.images[0].srcset" sizes="(max-width: 600px) 33vw, 300px" :alt="post.caption" loading="lazy" :style="placeholderStyle(post.images[0])" />
             <div v-else class="post-thumb post-thumb-empty">📷</div>
             <span v-if="post.images.length > 1" class="multi-badge">⧉</span>
           </div>
         </div>
         <div v-else class="empty-state">No posts yet.</div>
+        <div v-if="nextCursor" style="text-align:center; margin-top:16px;">
+          <button class="btn btn-secondary" @click="loadMore">Load more</button>
+        </div>
       </div>
       <div v-else class="page"><div class="spinner"></div></div>
 
@@ -87,7 +136,7 @@ export default {
         <div class="modal">
           <div class="modal-media">
             <template v-if="activePost.images.length">
-              <img :src="imgUrl(activePost.images[carouselIndex].url)" :alt="activePost.caption" />
+              <img :src="imgUrl(activePost.images[carouselIndex].url)" :srcset="activePost.images[carouselIndex].srcset" sizes="(max-width: 600px) 100vw, 600px" :width="activePost.images[carouselIndex].width" :height="activePost.images[carouselIndex].height" :style="placeholderStyle(activePost.images[carouselIndex])" :alt="activePost.caption" />
               <button v-if="activePost.images.length > 1" class="carousel-btn carousel-prev" @click="prevImage">‹</button>
               <button v-if="activePost.images.length > 1" class="carousel-btn carousel-next" @click="nextImage">›</button>
               <div v-if="activePost.images.length > 1" class="carousel-dots">
@@ -0,0 +1,55 @@
+import os
+from typing import Any
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Opt-in: hand handler output straight to orjson instead of letting FastAPI
+# re-validate it against response_model and encode it with the stdlib json
+# module. Routes keep their response_model, so the OpenAPI schema is unchanged.
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+
+# API bodies smaller than this go out uncompressed; static assets are
+# precompressed at build time (assets.py) and never pass through here.
+API_GZIP_MIN_SIZE = int(os.getenv("API_GZIP_MIN_SIZE", "1024"))
+API_GZIP_LEVEL    = int(os.getenv("API_GZIP_LEVEL", "6"))
+
+
+def trusted_json(content: Any, response: Response) -> Any:
+    """Return `content`, which the handler built in its response_model shape.
+
+    In fast mode it is encoded directly, carrying over any headers already
+    set on the handler's `response` (ETag, Cache-Control, ...).
+    """
+    if not FAST_JSON:
+        return content
+    return ORJSONResponse(content, headers=dict(response.headers))
+
+
+class APICompressionMiddleware:
+    """gzip /api responses above API_GZIP_MIN_SIZE for clients that accept it.
+
+    A strong ETag names one exact byte sequence, so on a gzipped body it is
+    weakened to W/"..." (conditional.py compares weakly).
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=API_GZIP_MIN_SIZE, compresslevel=API_GZIP_LEVEL)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith("/api/"):
+            async def send_weakened(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/") and "content-encoding" in headers:
+                        headers["etag"] = f"W/{etag}"
+                await send(message)
+
+            await self.gzip(scope, receive, send_weakened)
+        else:
+            await self.app(scope, receive, send)
@@ -1,16 +1,32 @@
 import os
+import httpx
 import stripe
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
-import provisioning
+import jobs
+from database import db
 
 load_dotenv()
 
-stripe.api_key   = os.getenv("STRIPE_SECRET_KEY")
 PRICE_ID         = os.getenv("STRIPE_PRICE_ID")
 WEBHOOK_SECRET   = os.getenv("STRIPE_WEBHOOK_SECRET")
 BASE_URL         = os.getenv("BASE_URL", "https://crimata.com")
+STRIPE_API_BASE  = os.getenv("STRIPE_API_BASE")   # e.g. a local stand-in (benchmarks/stripe_checkout.py)
+
+STRIPE_TIMEOUT         = float(os.getenv("STRIPE_TIMEOUT", "10"))        # s, per request
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "3"))
+STRIPE_RETRIES         = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "1"))   # sent with idempotency keys
+
+# Async client over one pooled, keep-alive httpx connection pool, so a call
+# to Stripe waits without holding up the event loop.
+stripe_client = stripe.StripeClient(
+    os.getenv("STRIPE_SECRET_KEY") or "",
+    http_client=stripe.HTTPXClient(timeout=httpx.Timeout(STRIPE_TIMEOUT, connect=STRIPE_CONNECT_TIMEOUT)),
+    max_network_retries=STRIPE_RETRIES,
+    base_addresses={"api": STRIPE_API_BASE} if STRIPE_API_BASE else {},
+)
 
 router = APIRouter(prefix="/api/checkout", tags=["checkout"])
 
@@ -18,31 +34,38 @@ router = APIRouter(prefix="/api/checkout", tags=["checkout"])
 @router.post("/create-session")
 async def create_session():
     try:
-        session = stripe.checkout.Session.create(
-            mode="subscription",
-            line_items=[{"price": PRICE_ID, "quantity": 1}],
-            success_url=f"{BASE_URL}/success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{BASE_URL}/",
-        )
+        session = await stripe_client.checkout.sessions.create_async(params={
+            "mode": "subscription",
+            "line_items": [{"price": PRICE_ID, "quantity": 1}],
+            "success_url": f"{BASE_URL}/success?session_id={{CHECKOUT_SESSION_ID}}",
+            "cancel_url": f"{BASE_URL}/",
+        })
         return {"url": session.url}
     except stripe.StripeError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _enqueue(kind: str, **payload) -> None:
+    with db.connection_context():
+        jobs.enqueue(kind, payload)
+
+
 @router.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
+async def webhook(request: Request):
+    """Verify the event and queue the work for the job worker (jobs.py)."""
     payload    = await request.body()
     sig_header = request.headers.get("stripe-signature")
 
+    # Local signature check (HMAC), no request to Stripe
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, WEBHOOK_SECRET)
+        event = stripe_client.construct_event(payload, sig_header, WEBHOOK_SECRET)
     except (ValueError, stripe.SignatureVerificationError):
         raise HTTPException(status_code=400, detail="Invalid webhook")
 
     if event["type"] == "checkout.session.completed":
         session = event["data"]["object"]
-        background_tasks.add_task(
-            provisioning.provision,
+        await run_in_threadpool(
+            _enqueue, "provision",
             stripe_customer_id=session["customer"],
             subscription_id=session["subscription"],
             email=session["customer_details"]["email"],
@@ -50,8 +73,8 @@ async def webhook(request: Request, background_tasks: BackgroundTasks):
 
     elif event["type"] == "customer.subscription.deleted":
         sub = event["data"]["object"]
-        background_tasks.add_task(
-            provisioning.deprovision,
+        await run_in_threadpool(
+            _enqueue, "deprovision",
             stripe_customer_id=sub["customer"],
         )
 
@@ -1,8 +1,21 @@
 from fastapi import APIRouter
 
+from cache import read_cache
+from database import db
+
 router = APIRouter(tags=["health"])
 
 
 @router.get("/api/health")
 async def health():
     return {"status": "ok"}
+
+
+@router.get("/api/health/cache")
+async def cache_stats():
+    return read_cache.stats()
+
+
+@router.get("/api/health/db")
+async def db_pool_stats():
+    return db.pool_stats()
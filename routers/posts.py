@@ -1,57 +1,165 @@
-import uuid
-from pathlib import Path
-from typing import Optional
-
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
-
+import base64
+import io
+import json
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from peewee import SQL, Cast, Expression, Tuple, ValuesList, fn
+from playhouse.postgres_ext import TS_MATCH
+
+import deletions
+import images
 import storage
-from database import db
+from cache import read_cache
+from conditional import bump_revision, conditional
+from database import current_tenant, db
+from responses import trusted_json
 from models import Post, PostImage, Tag, PostTag
-from schemas import PostCreate, PostUpdate, PostRead, ReorderImages
+from schemas import (PostCreate, PostUpdate, PostRead, PostPage, ReorderImages, TagCount,
+                     PresignImages, PresignedUpload, ConfirmImages)
 from auth import get_current_user
+from routers.uploads import check_upload, ingest, multipart_body, presign_upload, retain_stored, reusable_variants
 
 router = APIRouter(prefix="/api/posts", tags=["posts"])
 
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE     = 100
+
+EMPTY_JSON_ARRAY = SQL("'[]'::json")
+
+# (tenant schema, tag name) → id. Tags are never renamed or deleted, so
+# entries never go stale. The schema is None outside pooled mode.
+TAG_CACHE_SIZE = 1024
+_tag_ids: dict[tuple[str | None, str], int] = {}
+
+
+def _cached_tag_ids(names: list[str]) -> dict[str, int]:
+    tenant = current_tenant.get()
+    schema = tenant.schema if tenant is not None else None
+    return {n: _tag_ids[schema, n] for n in names if (schema, n) in _tag_ids}
+
+
+def _cache_tag_ids(ids: dict[str, int]) -> None:
+    tenant = current_tenant.get()
+    schema = tenant.schema if tenant is not None else None
+    if len(_tag_ids) + len(ids) > TAG_CACHE_SIZE:
+        _tag_ids.clear()
+    _tag_ids.update({(schema, n): i for n, i in ids.items()})
+
+
+def _post_document():
+    """json_build_object() expression producing the full PostRead shape of the outer Post row."""
+    images = (PostImage
+              .select(fn.json_agg(fn.json_build_object(
+                  'id', PostImage.id,
+                  'filename', PostImage.filename,
+                  # url and srcset are filled in by _fetch_documents(); listing
+                  # them here keeps PostImageRead key order
+                  'url', None,
+                  'order', PostImage.order,
+                  'variants', PostImage.variants,
+                  'srcset', None,
+                  'width', PostImage.width,
+                  'height', PostImage.height,
+                  'byte_size', PostImage.byte_size,
+                  'content_hash', PostImage.content_hash,
+                  'placeholder', PostImage.placeholder,
+              )).order_by(PostImage.order))
+              .where(PostImage.post == Post.id))
+    tags = (Tag
+            .select(fn.json_agg(fn.json_build_object(
+                'id', Tag.id,
+                'name', Tag.name,
+            )).order_by(Tag.name))
+            .join(PostTag)
+            .where(PostTag.post == Post.id))
+    return fn.json_build_object(
+        'id', Post.id,
+        'caption', Post.caption,
+        'location', Post.location,
+        'published', Post.published,
+        'created_at', Post.created_at,
+        'images', fn.COALESCE(images, EMPTY_JSON_ARRAY),
+        'tags', fn.COALESCE(tags, EMPTY_JSON_ARRAY),
+    )
 
 
-def _serialize_post(post_id: int) -> dict:
-    post = Post.get_or_none(Post.id == post_id)
-    if post is None:
-        raise HTTPException(status_code=404, detail="Post not found")
-    images = list(
-        PostImage.select()
-        .where(PostImage.post == post_id)
-        .order_by(PostImage.order)
-    )
-    tags = list(
-        Tag.select()
-        .join(PostTag)
-        .where(PostTag.post == post_id)
-    )
-    return {
-        "id": post.id,
-        "caption": post.caption,
-        "location": post.location,
-        "published": post.published,
-        "created_at": post.created_at,
-        "images": [
-            {"id": img.id, "filename": img.filename, "url": storage.public_url(img.filename), "order": img.order}
-            for img in images
-        ],
-        "tags": [{"id": tag.id, "name": tag.name} for tag in tags],
-    }
+def _fetch_documents(query, *extra) -> list[Post]:
+    """Run a Post query in one round trip, attaching the serialized post as `.doc`."""
+    posts = list(query.select(Post.id, Post.created_at, _post_document().alias('doc'), *extra))
+    for post in posts:
+        # Postgres renders timestamps in JSON with trimmed fractional seconds;
+        # use the parsed column so every encoder emits the same ISO format.
+        post.doc["created_at"] = post.created_at
+        for img in post.doc["images"]:
+            img["url"] = storage.public_url(img["filename"])
+            img["variants"], img["srcset"] = images.variant_fields(img["filename"], img["variants"])
+    return posts
 
 
-def _resolve_tags(tag_names: list[str]) -> list[Tag]:
-    tags = []
-    for name in tag_names:
-        name = name.strip().lower()
-        if not name:
-            continue
-        tag, _ = Tag.get_or_create(name=name)
-        tags.append(tag)
-    return tags
+def _serialize_post(post_id: int, published_only: bool = False) -> dict:
+    q = Post.select().where(Post.id == post_id)
+    if published_only:
+        q = q.where(Post.published == True)  # noqa: E712
+    posts = _fetch_documents(q)
+    if not posts:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return posts[0].doc
+
+
+def _resolve_tag_ids(tag_names: list[str]) -> list[int]:
+    """Map tag names to ids, creating missing tags in one INSERT ... ON CONFLICT DO NOTHING."""
+    names = list(dict.fromkeys(n.strip().lower() for n in tag_names if n.strip()))
+    ids = _cached_tag_ids(names)
+    missing = [n for n in names if n not in ids]
+    if missing:
+        ids.update(
+            Tag.insert_many([{"name": n} for n in missing])
+            .on_conflict_ignore()
+            .returning(Tag.name, Tag.id)
+            .tuples()
+            .execute()
+        )
+        # Names that already existed were skipped by the INSERT. Only these are
+        # cached: ids just inserted could still vanish if the caller rolls back.
+        existing = dict(
+            Tag.select(Tag.name, Tag.id)
+            .where(Tag.name << [n for n in missing if n not in ids])
+            .tuples()
+        ) if len(ids) < len(names) else {}
+        ids.update(existing)
+        _cache_tag_ids(existing)
+    return [ids[n] for n in names]
+
+
+def _known_tag_ids(tag_names: list[str]) -> list[int]:
+    """Ids of the named tags that exist, without creating any."""
+    names = list(dict.fromkeys(n.strip().lower() for n in tag_names if n.strip()))
+    ids = _cached_tag_ids(names)
+    missing = [n for n in names if n not in ids]
+    if missing:
+        found = dict(Tag.select(Tag.name, Tag.id).where(Tag.name << missing).tuples())
+        _cache_tag_ids(found)
+        ids.update(found)
+    return [ids[n] for n in names if n in ids]
+
+
+def _set_post_tags(post_id: int, tag_names: list[str]) -> list[int]:
+    """Write only the PostTag rows that differ from the post's current tag set.
+
+    Returns the new tag ids, sorted, for Post.tag_ids.
+    """
+    wanted = set(_resolve_tag_ids(tag_names))
+    current = {pt.tag_id for pt in PostTag.select(PostTag.tag).where(PostTag.post == post_id)}
+    removed = current - wanted
+    added = wanted - current
+    if removed:
+        PostTag.delete().where(PostTag.post == post_id, PostTag.tag << removed).execute()
+    if added:
+        PostTag.insert_many([{"post": post_id, "tag": tag_id} for tag_id in added]).execute()
+    return sorted(wanted)
 
 
 def _get_post_or_404(post_id: int, published_only: bool = False) -> Post:
@@ -64,79 +172,173 @@ def _get_post_or_404(post_id: int, published_only: bool = False) -> Post:
     return post
 
 
-def _batch_serialize(posts: list[Post]) -> list[dict]:
-    if not posts:
-        return []
-    ids = [p.id for p in posts]
-    imgs = (PostImage.select()
-            .where(PostImage.post << ids)
-            .order_by(PostImage.order))
-    pts = (PostTag.select(PostTag, Tag)
-           .join(Tag)
-           .where(PostTag.post << ids))
-
-    img_map: dict[int, list] = {pid: [] for pid in ids}
-    for img in imgs:
-        img_map[img.post_id].append({
-            "id": img.id,
-            "filename": img.filename,
-            "url": storage.public_url(img.filename),
-            "order": img.order,
-        })
-
-    tag_map: dict[int, list] = {pid: [] for pid in ids}
-    for pt in pts:
-        tag_map[pt.post_id].append({"id": pt.tag.id, "name": pt.tag.name})
-
-    return [
-        {
-            "id": p.id,
-            "caption": p.caption,
-            "location": p.location,
-            "published": p.published,
-            "created_at": p.created_at,
-            "images": img_map[p.id],
-            "tags": tag_map[p.id],
-        }
-        for p in posts
-    ]
+# Keyset orderings for _paginate(): (expression, alias, cursor value → SQL value)
+NEWEST_FIRST = (
+    (Post.created_at, "created_at", datetime.fromisoformat),
+    (Post.id, "id", int),
+)
+
+
+def _encode_cursor(values: list) -> str:
+    raw = json.dumps(values, default=lambda v: v.isoformat()).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, order) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(order):
+            raise ValueError(cursor)
+        return [parse(v) for (_, _, parse), v in zip(order, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _paginate(query, cursor: Optional[str], limit: int, order=NEWEST_FIRST) -> dict:
+    """Keyset page, descending over `order`; fetches one extra row to detect a next page."""
+    keys = [expr for expr, _, _ in order]
+    if cursor:
+        query = query.where(Tuple(*keys) < Tuple(*_decode_cursor(cursor, order)))
+    posts = _fetch_documents(
+        query.order_by(*[k.desc() for k in keys]).limit(limit + 1),
+        *[expr.alias(name) for expr, name, _ in order],
+    )
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+    return {
+        "items": [p.doc for p in posts],
+        "next_cursor": _encode_cursor([getattr(posts[-1], name) for _, name, _ in order]) if has_more else None,
+    }
+
+
+def _list_published(tag_names: tuple[str, ...], match: str, cursor: Optional[str], limit: int) -> dict:
+    with db.read_context():
+        q = Post.select().where(Post.published == True)  # noqa: E712
+        if tag_names:
+            ids = _known_tag_ids(list(tag_names))
+            if not ids or (match == "all" and len(ids) < len(tag_names)):
+                return {"items": [], "next_cursor": None}
+            q = q.where(Post.tag_ids.contains(*ids) if match == "all" else Post.tag_ids.contains_any(*ids))
+        return _paginate(q, cursor, limit)
+
+
+def _tag_counts() -> list[dict]:
+    with db.read_context():
+        counts = (Post
+                  .select(fn.unnest(Post.tag_ids).alias("tag_id"), fn.COUNT(SQL("*")).alias("count"))
+                  .where(Post.published == True)  # noqa: E712
+                  .group_by(SQL("1")))
+        rows = (Tag
+                .select(Tag.id, Tag.name, counts.c.count)
+                .join(counts, on=(Tag.id == counts.c.tag_id))
+                .order_by(counts.c.count.desc(), Tag.name)
+                .dicts())
+        return list(rows)
+
+
+def _search_published(q: str, cursor: Optional[str], limit: int) -> dict:
+    query = fn.websearch_to_tsquery('english', q)
+    rank = fn.ts_rank_cd(Post.search_vector, query)
+    order = (
+        # ts_rank_cd() returns real; compare the cursor at the same precision
+        (rank, "rank", lambda v: Cast(float(v), "real")),
+        (Post.id, "id", int),
+    )
+    with db.read_context():
+        matches = (Post
+                   .select()
+                   .where(Post.published == True,  # noqa: E712
+                          Expression(Post.search_vector, TS_MATCH, query)))
+        return _paginate(matches, cursor, limit, order)
+
+
+def _get_published(post_id: int) -> dict:
+    with db.read_context():
+        return _serialize_post(post_id, published_only=True)
+
+
+def _invalidate_public(post_id: int, *published: bool) -> None:
+    """Drop cached reads touched by a write to `post_id`.
+
+    `published` holds the post's published flag before and/or after the
+    write; feed pages only need flushing if the post is or was public.
+    """
+    read_cache.invalidate(("post", post_id))
+    if any(published):
+        read_cache.invalidate_prefix("posts")
+        read_cache.invalidate_prefix("search")
+        read_cache.invalidate(("tag_counts",))
 
 
 # ── Public endpoints ──────────────────────────────────────────────────────────
 
-@router.get("", response_model=list[PostRead])
-def list_posts(tag: Optional[str] = Query(None)):
-    with db.connection_context():
-        if tag:
-            tag_name = tag.strip().lower()
-            posts = list(
-                Post.select()
-                .join(PostTag)
-                .join(Tag)
-                .where(Post.published == True, Tag.name == tag_name)  # noqa: E712
-                .order_by(Post.created_at.desc())
-            )
-        else:
-            posts = list(
-                Post.select()
-                .where(Post.published == True)  # noqa: E712
-                .order_by(Post.created_at.desc())
-            )
-        return _batch_serialize(posts)
+@router.get("", response_model=PostPage)
+def list_posts(
+    request: Request,
+    response: Response,
+    tag: Optional[str] = Query(None),
+    tags: Optional[str] = Query(None, description="Comma-separated tag names"),
+    match: Literal["all", "any"] = Query("all"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    not_modified = conditional(request, response)
+    if not_modified is not None:
+        return not_modified
+    names = (tags.split(",") if tags else []) + ([tag] if tag else [])
+    tag_names = tuple(sorted({n.strip().lower() for n in names if n.strip()}))
+    page = read_cache.get_or_set(
+        ("posts", tag_names, match, cursor, limit),
+        lambda: _list_published(tag_names, match, cursor, limit),
+    )
+    return trusted_json(page, response)
 
 
-@router.get("/feed/all", response_model=list[PostRead])
-def list_all_posts(_: str = Depends(get_current_user)):
-    with db.connection_context():
-        posts = list(Post.select().order_by(Post.created_at.desc()))
-        return _batch_serialize(posts)
+@router.get("/tags", response_model=list[TagCount])
+def tag_counts(request: Request, response: Response):
+    not_modified = conditional(request, response)
+    if not_modified is not None:
+        return not_modified
+    return trusted_json(read_cache.get_or_set(("tag_counts",), _tag_counts), response)
+
+
+@router.get("/search", response_model=PostPage)
+def search_posts(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    not_modified = conditional(request, response)
+    if not_modified is not None:
+        return not_modified
+    page = read_cache.get_or_set(
+        ("search", q.strip(), cursor, limit),
+        lambda: _search_published(q, cursor, limit),
+    )
+    return trusted_json(page, response)
+
+
+@router.get("/feed/all", response_model=PostPage)
+def list_all_posts(
+    response: Response,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    _: str = Depends(get_current_user),
+):
+    with db.read_context():
+        return trusted_json(_paginate(Post.select(), cursor, limit), response)
 
 
 @router.get("/{post_id}", response_model=PostRead)
-def get_post(post_id: int):
-    with db.connection_context():
-        _get_post_or_404(post_id, published_only=True)
-        return _serialize_post(post_id)
+def get_post(post_id: int, request: Request, response: Response):
+    not_modified = conditional(request, response)
+    if not_modified is not None:
+        return not_modified
+    post = read_cache.get_or_set(("post", post_id), lambda: _get_published(post_id))
+    return trusted_json(post, response)
 
 
 # ── Owner endpoints ───────────────────────────────────────────────────────────
@@ -147,14 +349,18 @@ def create_post(
     _: str = Depends(get_current_user),
 ):
     with db.connection_context():
-        tags = _resolve_tags(body.tags)
-        post = Post.create(
-            caption=body.caption,
-            location=body.location,
-            published=body.published,
-        )
-        if tags:
-            PostTag.insert_many([{"post": post.id, "tag": t.id} for t in tags]).execute()
+        with db.atomic():
+            tag_ids = _resolve_tag_ids(body.tags)
+            post = Post.create(
+                caption=body.caption,
+                location=body.location,
+                published=body.published,
+                tag_ids=sorted(tag_ids),
+            )
+            if tag_ids:
+                PostTag.insert_many([{"post": post.id, "tag": tag_id} for tag_id in tag_ids]).execute()
+        bump_revision()
+        _invalidate_public(post.id, post.published)
         return _serialize_post(post.id)
 
 
@@ -166,18 +372,19 @@ def update_post(
 ):
     with db.connection_context():
         post = _get_post_or_404(post_id)
+        was_published = post.published
         if body.caption is not None:
             post.caption = body.caption
         if body.location is not None:
             post.location = body.location
         if body.published is not None:
             post.published = body.published
-        if body.tags is not None:
-            PostTag.delete().where(PostTag.post == post).execute()
-            tags = _resolve_tags(body.tags)
-            if tags:
-                PostTag.insert_many([{"post": post.id, "tag": t.id} for t in tags]).execute()
-        post.save()
+        with db.atomic():
+            if body.tags is not None:
+                post.tag_ids = _set_post_tags(post_id, body.tags)
+            post.save()
+        bump_revision()
+        _invalidate_public(post_id, was_published, post.published)
         return _serialize_post(post_id)
 
 
@@ -188,36 +395,155 @@ def delete_post(
 ):
     with db.connection_context():
         post = _get_post_or_404(post_id)
-        for img in PostImage.select().where(PostImage.post == post_id):
-            storage.delete(img.filename)
-        post.delete_instance(recursive=True)
+        with db.atomic():
+            filenames = list(PostImage.select(PostImage.filename).where(PostImage.post == post_id).scalars())
+            post.delete_instance(recursive=True)
+            deletions.release(filenames)
+        deletions.wake()
+        bump_revision()
+        _invalidate_public(post_id, post.published)
 
 
 # ── Image management ──────────────────────────────────────────────────────────
 
-@router.post("/{post_id}/images", response_model=PostRead)
-def upload_images(
+def _attach_images(post_id: int, uploads: list[tuple[str, dict]]) -> list[tuple[int, str]]:
+    """Append (filename, metadata) images to a post in one transaction.
+
+    An object another row already uses keeps its derivatives; returns the
+    new (id, filename) pairs that still need them.
+    """
+    with db.atomic():
+        retain_stored([filename for filename, _ in uploads])
+        next_order = (PostImage
+                      .select(fn.COALESCE(fn.MAX(PostImage.order), -1) + 1)
+                      .where(PostImage.post == post_id)
+                      .scalar())
+        reused = {filename: reusable_variants(filename) for filename, _ in uploads}
+        rows = (PostImage
+                .insert_many([
+                    {"post": post_id, "filename": filename, "order": next_order + i,
+                     "variants": reused[filename], **meta}
+                    for i, (filename, meta) in enumerate(uploads)
+                ])
+                .returning(PostImage.id, PostImage.filename)
+                .tuples()
+                .execute())
+        return [(image_id, filename) for image_id, filename in rows if not reused[filename]]
+
+
+@router.post("/{post_id}/images", response_model=PostRead, openapi_extra=multipart_body("files", many=True))
+async def upload_images(
     post_id: int,
-    files: list[UploadFile] = File(...),
+    request: Request,
+    background_tasks: BackgroundTasks,
     _: str = Depends(get_current_user),
 ):
+    """Upload through the API. Files are streamed into storage as the body
+    arrives (routers.uploads.ingest); dimensions and derivatives follow in
+    the background."""
+    await run_in_threadpool(_check_post_exists, post_id)
+    uploaded = await ingest(request, "files")
+    return await run_in_threadpool(_attach_uploaded, post_id, uploaded, background_tasks)
+
+
+def _check_post_exists(post_id: int) -> None:
     with db.connection_context():
         _get_post_or_404(post_id)
-        existing = list(PostImage.select().where(PostImage.post == post_id).order_by(PostImage.order))
-        next_order = max((img.order for img in existing), default=-1) + 1
-
-        for file in files:
-            ext = Path(file.filename).suffix.lower()
-            if ext not in ALLOWED_EXTENSIONS:
-                raise HTTPException(status_code=400, detail=f"File type {ext!r} not allowed")
-            filename = f"{uuid.uuid4()}{ext}"
-            storage.upload(file, filename)
-            PostImage.create(post=post_id, filename=filename, order=next_order)
-            next_order += 1
 
+
+def _attach_uploaded(post_id: int, uploaded: list[dict], background_tasks: BackgroundTasks) -> dict:
+    with db.connection_context():
+        try:
+            post = _get_post_or_404(post_id)
+            to_render = _attach_images(post_id, [
+                (u["filename"], {"byte_size": u["byte_size"], "content_hash": u["content_hash"]})
+                for u in uploaded
+            ])
+        except Exception:
+            deletions.release([u["filename"] for u in uploaded if u["created"]])
+            deletions.wake()
+            raise
+        bump_revision()
+        _invalidate_public(post_id, post.published)
+        background_tasks.add_task(_describe_uploads, post_id, [u["filename"] for u in uploaded], to_render)
         return _serialize_post(post_id)
 
 
+@router.post("/{post_id}/images/presign", response_model=list[PresignedUpload])
+def presign_images(
+    post_id: int,
+    body: PresignImages,
+    _: str = Depends(get_current_user),
+):
+    """Phase one of a direct upload: signed PUT URLs, one per file."""
+    with db.connection_context():
+        _get_post_or_404(post_id)
+    return [presign_upload(file) for file in body.files]
+
+
+@router.post("/{post_id}/images/confirm", response_model=PostRead)
+def confirm_images(
+    post_id: int,
+    body: ConfirmImages,
+    background_tasks: BackgroundTasks,
+    _: str = Depends(get_current_user),
+):
+    """Phase two: attach uploaded objects to the post once storage has them."""
+    uploaded = [(key, {"byte_size": check_upload(key)["size"]}) for key in body.keys]
+    with db.connection_context():
+        post = _get_post_or_404(post_id)
+        new_images = _attach_images(post_id, uploaded)
+        bump_revision()
+        _invalidate_public(post_id, post.published)
+        background_tasks.add_task(_describe_uploads, post_id, [key for key, _ in uploaded], new_images)
+        return _serialize_post(post_id)
+
+
+def _describe_uploads(post_id: int, filenames: list[str], to_render: list[tuple[int, str]]) -> None:
+    """Background task for new uploads: fill in the metadata that needs the
+    decoded image (dimensions, placeholder, and for direct uploads the hash),
+    then build derivatives."""
+    described = []
+    for filename in dict.fromkeys(filenames):
+        try:
+            described.append((filename, images.describe(io.BytesIO(storage.read(filename)))))
+        except Exception as e:   # removed or unreadable since confirm
+            print(f"Describing {filename} failed: {e}")
+    with db.connection_context():
+        updated = sum(PostImage
+                      .update(**meta)
+                      .where(PostImage.post == post_id, PostImage.filename == filename,
+                             PostImage.width.is_null())
+                      .execute()
+                      for filename, meta in described)
+        if updated:
+            post = Post.get_or_none(Post.id == post_id)
+            bump_revision()
+            _invalidate_public(post_id, post is not None and post.published)
+    _generate_variants(post_id, to_render)
+
+
+def _generate_variants(post_id: int, new_images: list[tuple[int, str]]) -> None:
+    """Background task: build derivatives, then publish them on the image rows."""
+    rendered = {filename: images.make_variants(filename)
+                for filename in dict.fromkeys(filename for _, filename in new_images)}
+    changed = False
+    with db.connection_context():
+        for image_id, filename in new_images:
+            widths = rendered[filename]
+            if not widths:
+                continue
+            if PostImage.update(variants=widths).where(PostImage.id == image_id).execute():
+                changed = True
+            else:   # image was deleted while we were rendering
+                deletions.release([filename])
+                deletions.wake()
+        if changed:
+            post = Post.get_or_none(Post.id == post_id)
+            bump_revision()
+            _invalidate_public(post_id, post is not None and post.published)
+
+
 @router.delete("/{post_id}/images/{image_id}", response_model=PostRead)
 def delete_image(
     post_id: int,
@@ -225,12 +551,16 @@ def delete_image(
     _: str = Depends(get_current_user),
 ):
     with db.connection_context():
-        _get_post_or_404(post_id)
+        post = _get_post_or_404(post_id)
         img = PostImage.get_or_none(PostImage.id == image_id, PostImage.post == post_id)
         if img is None:
             raise HTTPException(status_code=404, detail="Image not found")
-        storage.delete(img.filename)
-        img.delete_instance()
+        with db.atomic():
+            img.delete_instance()
+            deletions.release([img.filename])
+        deletions.wake()
+        bump_revision()
+        _invalidate_public(post_id, post.published)
         return _serialize_post(post_id)
 
 
@@ -241,12 +571,25 @@ def reorder_images(
     _: str = Depends(get_current_user),
 ):
     with db.connection_context():
-        _get_post_or_404(post_id)
-        images = list(PostImage.select().where(PostImage.post == post_id))
-        id_to_img = {img.id: img for img in images}
-        for order, image_id in enumerate(body.image_ids):
-            if image_id in id_to_img:
-                img = id_to_img[image_id]
-                img.order = order
-                img.save()
-        return _serialize_post(post_id)
+        with db.atomic():
+            changed = 0
+            if body.image_ids:
+                # One set-based UPDATE; ids from other posts and rows already
+                # in place are filtered out by the WHERE clause.
+                new_order = ValuesList(
+                    [(image_id, order) for order, image_id in enumerate(dict.fromkeys(body.image_ids))],
+                    columns=("id", "order"),
+                    alias="new_order",
+                )
+                changed = (PostImage
+                           .update(order=new_order.c.order)
+                           .from_(new_order)
+                           .where(PostImage.id == new_order.c.id,
+                                  PostImage.post == post_id,
+                                  PostImage.order != new_order.c.order)
+                           .execute())
+            doc = _serialize_post(post_id)
+        if changed:
+            bump_revision()
+            _invalidate_public(post_id, doc["published"])
+        return doc
@@ -1,26 +1,37 @@
-import uuid
-from pathlib import Path
-
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import io
+from fastapi import APIRouter, BackgroundTasks, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
 
+import deletions
+import images
 import storage
+from cache import read_cache
+from conditional import bump_revision, conditional
 from database import db
+from responses import trusted_json
 from models import Profile
-from schemas import ProfileRead, ProfileUpdate
+from schemas import ProfileRead, ProfileUpdate, UploadRequest, PresignedUpload, ConfirmAvatar
 from auth import get_current_user
+from routers.uploads import check_upload, ingest, multipart_body, presign_upload, retain_stored, reusable_variants
 
 router = APIRouter(prefix="/api/profile", tags=["profile"])
 
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
-
 
 def _profile_to_dict(profile: Profile) -> dict:
+    avatar_variants, avatar_srcset = images.variant_fields(profile.avatar_filename, profile.avatar_variants)
     return {
         "id": profile.id,
         "name": profile.name,
         "bio": profile.bio,
         "avatar_filename": profile.avatar_filename,
         "avatar_url": storage.public_url(profile.avatar_filename),
+        "avatar_variants": avatar_variants,
+        "avatar_srcset": avatar_srcset,
+        "avatar_width": profile.avatar_width,
+        "avatar_height": profile.avatar_height,
+        "avatar_byte_size": profile.avatar_byte_size,
+        "avatar_content_hash": profile.avatar_content_hash,
+        "avatar_placeholder": profile.avatar_placeholder,
         "links": profile.links or [],
     }
 
@@ -32,10 +43,22 @@ def _get_or_create_profile() -> Profile:
     return profile
 
 
+def _load_profile() -> dict:
+    with db.read_context():
+        profile = Profile.get_or_none()
+    if profile is None:
+        # first visit: the row is created on the primary
+        with db.connection_context():
+            profile = _get_or_create_profile()
+    return _profile_to_dict(profile)
+
+
 @router.get("", response_model=ProfileRead)
-def get_profile():
-    with db.connection_context():
-        return _profile_to_dict(_get_or_create_profile())
+def get_profile(request: Request, response: Response):
+    not_modified = conditional(request, response)
+    if not_modified is not None:
+        return not_modified
+    return trusted_json(read_cache.get_or_set(("profile",), _load_profile), response)
 
 
 @router.patch("", response_model=ProfileRead)
@@ -52,27 +75,118 @@ def update_profile(
         if body.links is not None:
             profile.links = [link.model_dump() for link in body.links]
         profile.save()
+        bump_revision()
+        read_cache.invalidate(("profile",))
         return _profile_to_dict(profile)
 
 
-@router.post("/avatar", response_model=ProfileRead)
-def upload_avatar(
-    file: UploadFile = File(...),
+@router.post("/avatar", response_model=ProfileRead, openapi_extra=multipart_body("file", many=False))
+async def upload_avatar(
+    request: Request,
+    background_tasks: BackgroundTasks,
     _: str = Depends(get_current_user),
 ):
-    ext = Path(file.filename).suffix.lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail=f"File type {ext!r} not allowed")
+    """Upload through the API, streamed into storage as the body arrives
+    (routers.uploads.ingest)."""
+    uploaded, = await ingest(request, "file", max_files=1)
+    return await run_in_threadpool(_set_uploaded_avatar, uploaded, background_tasks)
 
+
+def _set_uploaded_avatar(uploaded: dict, background_tasks: BackgroundTasks) -> dict:
+    filename = uploaded["filename"]
+    with db.connection_context():
+        try:
+            profile = _get_or_create_profile()
+            render = _replace_avatar(profile, filename, {"byte_size": uploaded["byte_size"],
+                                                         "content_hash": uploaded["content_hash"]})
+        except Exception:
+            if uploaded["created"]:
+                deletions.release([filename])
+                deletions.wake()
+            raise
+        background_tasks.add_task(_describe_avatar_upload, filename, render)
+        return _profile_to_dict(profile)
+
+
+@router.post("/avatar/presign", response_model=PresignedUpload)
+def presign_avatar(
+    body: UploadRequest,
+    _: str = Depends(get_current_user),
+):
+    """Phase one of a direct avatar upload: a signed PUT URL."""
+    return presign_upload(body)
+
+
+@router.post("/avatar/confirm", response_model=ProfileRead)
+def confirm_avatar(
+    body: ConfirmAvatar,
+    background_tasks: BackgroundTasks,
+    _: str = Depends(get_current_user),
+):
+    """Phase two: make the uploaded object the avatar once storage has it."""
+    uploaded = check_upload(body.key)
     with db.connection_context():
         profile = _get_or_create_profile()
+        render = _replace_avatar(profile, body.key, {"byte_size": uploaded["size"]})
+        background_tasks.add_task(_describe_avatar_upload, body.key, render)
+        return _profile_to_dict(profile)
 
-        if profile.avatar_filename:
-            storage.delete(profile.avatar_filename)
 
-        filename = f"{uuid.uuid4()}{ext}"
-        storage.upload(file, filename)
+def _replace_avatar(profile: Profile, filename: str, meta: dict) -> bool:
+    """Point the profile at a stored avatar and release the previous one.
 
-        profile.avatar_filename = filename
+    Returns True if the avatar still needs its derivatives generated.
+    """
+    previous = profile.avatar_filename
+    profile.avatar_variants = reusable_variants(filename)
+    profile.avatar_filename = filename
+    for key in ("width", "height", "byte_size", "content_hash", "placeholder"):
+        setattr(profile, f"avatar_{key}", meta.get(key))
+    with db.atomic():
+        retain_stored([filename])
         profile.save()
-        return _profile_to_dict(profile)
+        if previous != filename:
+            deletions.release([previous])
+    deletions.wake()
+    bump_revision()
+    read_cache.invalidate(("profile",))
+    return not profile.avatar_variants
+
+
+def _describe_avatar_upload(filename: str, render: bool) -> None:
+    """Background task for a new avatar: fill in the metadata that needs the
+    decoded image, then build derivatives."""
+    try:
+        meta = images.describe(io.BytesIO(storage.read(filename)))
+    except Exception as e:   # removed or unreadable since confirm
+        print(f"Describing {filename} failed: {e}")
+        return
+    with db.connection_context():
+        updated = (Profile
+                   .update(**{f"avatar_{k}": v for k, v in meta.items()})
+                   .where(Profile.avatar_filename == filename)
+                   .execute())
+        if not updated:   # replaced in the meantime
+            return
+        bump_revision()
+    read_cache.invalidate(("profile",))
+    if render:
+        _generate_avatar_variants(filename)
+
+
+def _generate_avatar_variants(filename: str) -> None:
+    """Background task: build avatar derivatives, then publish them on the profile."""
+    widths = images.make_variants(filename)
+    if not widths:
+        return
+    with db.connection_context():
+        updated = (Profile
+                   .update(avatar_variants=widths)
+                   .where(Profile.avatar_filename == filename)
+                   .execute())
+        if not updated:   # avatar was replaced while we were rendering
+            deletions.release([filename])
+            deletions.wake()
+            return
+        bump_revision()
+    read_cache.invalidate(("profile",))
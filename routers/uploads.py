@@ -0,0 +1,271 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+import deletions
+import images
+import storage
+from database import db
+from models import PostImage, Profile
+from schemas import UploadRequest
+
+router = APIRouter(prefix="/api/uploads", tags=["uploads"])
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+# Streaming uploads: the whole multipart body, and how many files it may carry.
+# Each file is also held to storage.MAX_UPLOAD_BYTES.
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+MAX_REQUEST_FILES = int(os.getenv("MAX_REQUEST_FILES", "20"))
+
+_SHA256_HEX  = re.compile(r"[0-9a-f]{64}")
+_CONTENT_KEY = re.compile(r"[0-9a-f]{64}(-[0-9a-f]{32})?")   # see storage.content_key
+_WRITE_CHUNK = 1024 * 1024   # bytes handed to a storage thread at a time
+
+
+# ── Content-addressed objects, shared between rows ───────────────────────────
+
+def reusable_variants(filename: str) -> list[int]:
+    """Variant widths already generated for this object by another row."""
+    for widths in (PostImage.select(PostImage.variants).where(PostImage.filename == filename).scalars()):
+        if widths:
+            return widths
+    profile = Profile.get_or_none(Profile.avatar_filename == filename)
+    return profile.avatar_variants if profile is not None else []
+
+
+def retain_stored(filenames: list[str]) -> None:
+    """Call inside the transaction that makes rows reference `filenames`,
+    before writing them. Keeps the deletion worker off them
+    (deletions.retain), then checks they are still stored: an object found
+    already stored at upload time may have been deleted since."""
+    deletions.retain(filenames)
+    for filename in dict.fromkeys(filenames):
+        if storage.head(filename) is None:
+            raise HTTPException(status_code=409, detail=f"Upload {filename!r} was removed meanwhile; upload it again")
+
+
+# ── Streaming multipart uploads ───────────────────────────────────────────────
+
+def multipart_body(field: str, many: bool) -> dict:
+    """openapi_extra for a handler that reads its files with ingest()."""
+    file = {"type": "string", "format": "binary"}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": [field],
+        "properties": {field: {"type": "array", "items": file} if many else file},
+    }}}}}
+
+
+class _FilePart:
+    """One file of a multipart body, hashed and written as it arrives."""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.pending = bytearray()
+        self.writer: storage.ObjectWriter | None = None
+        self.content_type = None
+        self.ext = None
+
+    async def feed(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > storage.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Files must be at most {storage.MAX_UPLOAD_BYTES} bytes")
+        self.digest.update(data)
+        if self.writer is None:
+            self.head += data
+            if len(self.head) < images.SNIFF_BYTES:
+                return
+            self._open()
+            data, self.head = self.head, b""
+        self.pending += data
+        if len(self.pending) >= _WRITE_CHUNK:
+            await self._drain()
+
+    def _open(self) -> None:
+        sniffed = images.sniff(self.head)
+        if sniffed is None:
+            raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF and WebP images are allowed")
+        self.content_type, self.ext = sniffed
+        self.writer = storage.ObjectWriter(self.content_type)
+
+    async def _drain(self) -> None:
+        data, self.pending = bytes(self.pending), bytearray()
+        await run_in_threadpool(self.writer.write, data)
+
+    async def finish(self) -> dict:
+        if self.writer is None:   # shorter than the sniffing window
+            self._open()
+            self.pending += self.head
+        if self.pending:
+            await self._drain()
+        content_hash = self.digest.hexdigest()
+        filename = storage.content_key(content_hash, self.ext)
+        created = await run_in_threadpool(self.writer.commit, filename)
+        self.writer = None
+        return {"filename": filename, "content_type": self.content_type, "byte_size": self.size,
+                "content_hash": content_hash, "created": created}
+
+    async def abort(self) -> None:
+        if self.writer is not None:
+            await run_in_threadpool(self.writer.abort)
+
+
+def _discard(filenames: list[str]) -> None:
+    with db.connection_context():
+        deletions.release(filenames)
+    deletions.wake()
+
+
+async def ingest(request: Request, field: str, max_files: int = MAX_REQUEST_FILES) -> list[dict]:
+    """Stream the files of multipart field `field` into storage.
+
+    The body is parsed as it arrives; each file is hashed, type-checked from
+    its first bytes and written to storage in chunks, so memory use does not
+    grow with the upload. Size and count limits fail the request as soon as
+    they are exceeded. Returns, per file, its content-addressed `filename`,
+    `content_type`, `byte_size`, `content_hash` and whether this request
+    `created` the stored object. If the request fails, objects it created
+    are released again.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data body")
+    if int(request.headers.get("content-length") or 0) > MAX_REQUEST_BYTES:
+        raise HTTPException(status_code=413, detail=f"Uploads must be at most {MAX_REQUEST_BYTES} bytes in total")
+
+    # The parser reports through callbacks; collect what one chunk produced
+    # and act on it (with awaits) after each write.
+    events: list[tuple] = []
+    headers: dict[bytes, bytes] = {}
+    name, value = bytearray(), bytearray()
+
+    def on_header_end():
+        headers[bytes(name).lower()] = bytes(value)
+        name.clear()
+        value.clear()
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_header_field": lambda data, start, end: name.extend(data[start:end]),
+        "on_header_value": lambda data, start, end: value.extend(data[start:end]),
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end",)),
+    })
+
+    results: list[dict] = []
+    part: _FilePart | None = None
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_REQUEST_BYTES:
+                raise HTTPException(status_code=413, detail=f"Uploads must be at most {MAX_REQUEST_BYTES} bytes in total")
+            try:
+                parser.write(chunk)
+            except MultipartParseError:
+                raise HTTPException(status_code=400, detail="Malformed multipart body") from None
+            for event in events:
+                if event[0] == "headers":
+                    _, options = parse_options_header(event[1].get(b"content-disposition", b""))
+                    part = None
+                    if options.get(b"name") == field.encode() and b"filename" in options:
+                        if len(results) >= max_files:
+                            raise HTTPException(status_code=413, detail=f"At most {max_files} file(s) per request")
+                        part = _FilePart()
+                elif part is None:
+                    continue   # another field; its bytes are dropped
+                elif event[0] == "data":
+                    await part.feed(event[1])
+                else:
+                    results.append(await part.finish())
+                    part = None
+            events.clear()
+        if part is not None:
+            raise HTTPException(status_code=400, detail="Multipart body ended mid-file")
+        if not results:
+            raise HTTPException(status_code=400, detail=f"No files in field {field!r}")
+    except BaseException:
+        if part is not None:
+            await part.abort()
+        created = [r["filename"] for r in results if r["created"]]
+        if created:
+            await run_in_threadpool(_discard, created)
+        raise
+    return results
+
+
+# ── Two-phase uploads: presign, client PUTs, confirm ──────────────────────────
+
+def presign_upload(file: UploadRequest) -> dict:
+    """Sign a PUT of `file` to its content address.
+
+    Returns no URL if storage already holds the same bytes; the client goes
+    straight to confirm.
+    """
+    ext = Path(file.filename).suffix.lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"File type {ext!r} not allowed")
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail=f"Content type {file.content_type!r} not allowed")
+    if not 0 < file.size <= storage.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Files must be at most {storage.MAX_UPLOAD_BYTES} bytes")
+    if not _SHA256_HEX.fullmatch(file.sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be a lowercase hex digest")
+    key = storage.content_key(file.sha256, ext)
+    stored = storage.head(key)
+    if stored is not None and stored["size"] == file.size:
+        return {"key": key, "url": None, "method": "PUT", "headers": {}}
+    return storage.presign_put(key, file.content_type, file.size)
+
+
+def check_upload(key: str) -> dict:
+    """HEAD a key the client says it uploaded; returns the object's size and type.
+
+    Only content addresses with an allowed extension are accepted. Call
+    outside the connection context; it is a storage round trip.
+    """
+    if not (_CONTENT_KEY.fullmatch(Path(key).stem) and Path(key).suffix in ALLOWED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail=f"Invalid upload key {key!r}")
+    meta = storage.head(key)
+    if meta is None:
+        raise HTTPException(status_code=400, detail=f"Upload {key!r} not found")
+    if meta["size"] > storage.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Files must be at most {storage.MAX_UPLOAD_BYTES} bytes")
+    return meta
+
+
+# ── Dev stand-in for S3 ───────────────────────────────────────────────────────
+
+@router.put("/{filename}", status_code=200)
+async def put_upload(
+    filename: str,
+    request: Request,
+    expires: int = Query(...),
+    size: int = Query(...),
+    content_type: str = Query(...),
+    signature: str = Query(...),
+):
+    """Local equivalent of a presigned S3 PUT (storage.presign_put)."""
+    if storage.APP_ENV == "prod":
+        raise HTTPException(status_code=404, detail="Not found")
+    if not storage.verify_local_put(filename, expires, size, content_type, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired upload URL")
+    if request.headers.get("content-type") != content_type:
+        raise HTTPException(status_code=400, detail="Content-Type does not match the signed upload")
+    if not await storage.write_local(filename, request.stream(), size):
+        raise HTTPException(status_code=400, detail="Body size does not match the signed upload")
+    return Response(status_code=200)
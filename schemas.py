@@ -3,6 +3,13 @@ from typing import Optional
 from pydantic import BaseModel
 
 
+# ── Images ───────────────────────────────────────────────────────────────────
+
+class ImageVariant(BaseModel):
+    width: int
+    url: str
+
+
 # ── Profile ──────────────────────────────────────────────────────────────────
 
 class LinkItem(BaseModel):
@@ -16,6 +23,13 @@ class ProfileRead(BaseModel):
     bio: str
     avatar_filename: Optional[str]
     avatar_url: Optional[str]
+    avatar_variants: list[ImageVariant]
+    avatar_srcset: Optional[str]
+    avatar_width: Optional[int]
+    avatar_height: Optional[int]
+    avatar_byte_size: Optional[int]
+    avatar_content_hash: Optional[str]
+    avatar_placeholder: Optional[str]
     links: list[LinkItem]
 
     model_config = {"from_attributes": True}
@@ -36,6 +50,10 @@ class TagRead(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class TagCount(TagRead):
+    count: int
+
+
 # ── PostImage ─────────────────────────────────────────────────────────────────
 
 class PostImageRead(BaseModel):
@@ -43,6 +61,14 @@ class PostImageRead(BaseModel):
     filename: str
     url: str
     order: int
+    variants: list[ImageVariant]
+    srcset: Optional[str]
+    # None for images uploaded before metadata existed, until backfill.py runs
+    width: Optional[int]
+    height: Optional[int]
+    byte_size: Optional[int]
+    content_hash: Optional[str]
+    placeholder: Optional[str]
 
     model_config = {"from_attributes": True}
 
@@ -75,12 +101,45 @@ class PostRead(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class PostPage(BaseModel):
+    items: list[PostRead]
+    next_cursor: Optional[str]
+
+
 # ── Image reorder ─────────────────────────────────────────────────────────────
 
 class ReorderImages(BaseModel):
     image_ids: list[int]
 
 
+# ── Direct uploads ────────────────────────────────────────────────────────────
+
+class UploadRequest(BaseModel):
+    filename: str
+    content_type: str
+    size: int
+    sha256: str   # hex digest of the file; names the stored object
+
+
+class PresignImages(BaseModel):
+    files: list[UploadRequest]
+
+
+class PresignedUpload(BaseModel):
+    key: str
+    url: Optional[str]   # None: storage already holds this content, skip the PUT
+    method: str
+    headers: dict[str, str]
+
+
+class ConfirmImages(BaseModel):
+    keys: list[str]
+
+
+class ConfirmAvatar(BaseModel):
+    key: str
+
+
 # ── Auth ──────────────────────────────────────────────────────────────────────
 
 class TokenRequest(BaseModel):
@@ -0,0 +1,90 @@
+"""
+HTML pages served from memory.
+
+Each page is read from disk once. The SPA shell (index.html) served at a
+hub's "/", the public profile, also carries a JSON bootstrap: the profile,
+the first page of published posts and the tag counts. PublicProfileView
+renders from it instead of calling /api/profile, /api/posts and
+/api/posts/tags on first load. Every other route gets the plain shell. Rendered shells are cached per content revision, so every owner
+write (which bumps the revision) retires them.
+"""
+import gzip, hashlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable
+
+import orjson
+from fastapi import Request, Response
+
+from assets import accepted_codings
+from cache import read_cache
+from conditional import current_revision
+from routers.posts import DEFAULT_PAGE_SIZE, _list_published, _tag_counts
+from routers.profile import _load_profile
+
+HTML_CACHE_CONTROL = "no-cache"
+GZIP_LEVEL = 6
+
+_BOOTSTRAP = b'<script id="bootstrap" type="application/json">%s</script>\n'
+
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+@lru_cache(maxsize=None)
+def _page(path: Path) -> tuple[bytes, bytes, str]:
+    body = path.read_bytes()
+    return body, _gzip(body), hashlib.sha256(body).hexdigest()[:12]
+
+
+def _bootstrap() -> bytes:
+    # Same cache entries the API endpoints use for these requests.
+    posts = read_cache.get_or_set(
+        ("posts", (), "all", None, DEFAULT_PAGE_SIZE),
+        lambda: _list_published((), "all", None, DEFAULT_PAGE_SIZE),
+    )
+    data = {
+        "profile": read_cache.get_or_set(("profile",), _load_profile),
+        "posts": posts,
+        "tags": read_cache.get_or_set(("tag_counts",), _tag_counts),
+    }
+    # "<" can only occur inside JSON strings, where the \u003c escape means
+    # the same thing and cannot close the script element.
+    return orjson.dumps(data).replace(b"<", b"\\u003c")
+
+
+def _render_shell(template: bytes) -> tuple[bytes, bytes]:
+    html = template.replace(b"</body>", _BOOTSTRAP % _bootstrap() + b"</body>", 1)
+    return html, _gzip(html)
+
+
+def _respond(request: Request, etag: str, render: Callable[[], tuple[bytes, bytes]]) -> Response:
+    headers = {"ETag": etag, "Cache-Control": HTML_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    body, gzipped = render()
+    if "gzip" in accepted_codings(request.headers.get("accept-encoding", "")):
+        return Response(gzipped, media_type="text/html", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(body, media_type="text/html", headers=headers)
+
+
+def html_page(request: Request, path: Path) -> Response:
+    """Serve a static HTML file from memory."""
+    body, gzipped, digest = _page(path)
+    return _respond(request, f'W/"{digest}"', lambda: (body, gzipped))
+
+
+def spa_shell(request: Request, path: Path, route: str) -> Response:
+    """Serve the SPA shell at `path` for the client-side `route`, with the
+    bootstrap embedded on the public profile route ("/"), the only view that
+    reads it. Opens its own connection on a cache miss."""
+    if route.strip("/"):
+        return html_page(request, path)
+    template, _, digest = _page(path)
+    revision = current_revision()[0].strip('"')
+    return _respond(
+        request,
+        f'W/"{digest}.{revision}"',
+        lambda: read_cache.get_or_set(("shell", path, revision), lambda: _render_shell(template)),
+    )
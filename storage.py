@@ -1,42 +1,342 @@
+import base64
+import hashlib
+import hmac
 import os
-import shutil
+import re
+import time
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import AsyncIterator, Iterator
+from urllib.parse import urlencode
 
 import boto3
-from fastapi import UploadFile
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import auth
+from database import current_tenant
 
 APP_ENV    = os.getenv("APP_ENV", "dev")
 S3_BUCKET  = os.getenv("S3_BUCKET")
+# This deployment's part of the bucket, e.g. "alice" for a dedicated hub or
+# "pool" for the pooled fleet. Buckets are shared, so anything that lists
+# objects needs one (see scoped()).
+STORAGE_PREFIX = os.getenv("STORAGE_PREFIX", "").strip("/")
 S3_REGION  = os.getenv("AWS_REGION", "us-east-1")
 UPLOAD_DIR = Path(__file__).parent / "static" / "uploads"
 
-_s3 = boto3.client("s3", region_name=S3_REGION) if APP_ENV == "prod" else None
+# Streamed uploads larger than this go to S3 as multipart uploads, one part
+# of this size in memory at a time (S3's minimum part size is 5 MiB).
+MULTIPART_THRESHOLD = max(int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+# Objects are named after their content (see content_key), so they never
+# change once written and can be cached for good.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Direct uploads: the client PUTs to a presigned URL, then confirms.
+MAX_UPLOAD_BYTES   = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_URL_EXPIRES = int(os.getenv("UPLOAD_URL_EXPIRES", "900"))   # seconds
+
+_BARE_HASH = re.compile(r"[0-9a-f]{64}")
+
+# SigV4, so presigned PUTs sign Content-Length and Content-Type
+_s3 = (boto3.client("s3", region_name=S3_REGION, config=Config(signature_version="s3v4"))
+       if APP_ENV == "prod" else None)
+
+
+
+def content_key(sha256_hex: str, ext: str) -> str:
+    """Object name for content with this SHA-256; identical bytes share one object.
+
+    Only where the objects are this deployment's own (scoped()). Hubs that
+    still write to the root of a shared bucket would share objects with
+    other hubs, whose references they can't see, so each upload there gets
+    a name of its own.
+    """
+    if scoped():
+        return f"{sha256_hex}{ext}"
+    return f"{sha256_hex}-{uuid.uuid4().hex}{ext}"
+
+
+def owned(filename: str) -> bool:
+    """Whether `filename` can only be this deployment's object, so deleting
+    it can't break another's: anything in scoped storage, and per-upload
+    names elsewhere (content_key)."""
+    return scoped() or not _BARE_HASH.fullmatch(Path(filename).stem)
+
+
+def key_hash(filename: str) -> str:
+    """The SHA-256 a content_key() was made from."""
+    return Path(filename).stem[:64]
+
+
+# Objects live under "<STORAGE_PREFIX>/", and pooled tenancy stores each
+# tenant's under a further "<slug>/". Callers and the database only ever see
+# the bare filename.
+def _prefix() -> str:
+    tenant = current_tenant.get()
+    parts = [STORAGE_PREFIX] if STORAGE_PREFIX else []
+    if tenant is not None:
+        parts.append(tenant.slug)
+    return "".join(f"{part}/" for part in parts)
 
 
-def upload(file: UploadFile, filename: str) -> None:
+def scoped() -> bool:
+    """Whether list_objects() sees only this deployment's objects. Locally
+    the upload directory is the deployment's own; in a bucket it takes a
+    prefix."""
+    return APP_ENV != "prod" or bool(_prefix())
+
+
+def _key(filename: str) -> str:
+    return _prefix() + filename
+
+
+def _path(filename: str, create: bool = False) -> Path:
+    path = UPLOAD_DIR / _key(filename)
+    if create:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def put(filename: str, data: bytes, content_type: str) -> None:
     if APP_ENV == "prod":
-        _s3.upload_fileobj(
-            file.file, S3_BUCKET, filename,
-            ExtraArgs={"ContentType": file.content_type or "application/octet-stream"},
-        )
+        _s3.put_object(Bucket=S3_BUCKET, Key=_key(filename), Body=data, ContentType=content_type,
+                       CacheControl=IMMUTABLE_CACHE_CONTROL)
     else:
-        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-        with (UPLOAD_DIR / filename).open("wb") as f:
-            shutil.copyfileobj(file.file, f)
+        _path(filename, create=True).write_bytes(data)
+
+
+def read(filename: str) -> bytes:
+    if APP_ENV == "prod":
+        return _s3.get_object(Bucket=S3_BUCKET, Key=_key(filename))["Body"].read()
+    return _path(filename).read_bytes()
 
 
 def delete(filename: str) -> None:
     if APP_ENV == "prod":
-        _s3.delete_object(Bucket=S3_BUCKET, Key=filename)
+        _s3.delete_object(Bucket=S3_BUCKET, Key=_key(filename))
     else:
-        path = UPLOAD_DIR / filename
+        path = _path(filename)
         if path.exists():
             path.unlink()
 
 
+def delete_many(filenames: list[str]) -> list[str]:
+    """Delete objects in bulk (S3 allows 1000 keys per request). Returns the
+    ones that could not be deleted; missing objects count as deleted."""
+    if APP_ENV == "prod":
+        failed = []
+        for i in range(0, len(filenames), 1000):
+            resp = _s3.delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": _key(f)} for f in filenames[i:i + 1000]], "Quiet": True},
+            )
+            prefix = _prefix()
+            failed += [e["Key"][len(prefix):] for e in resp.get("Errors", [])]
+        return failed
+    failed = []
+    for filename in filenames:
+        try:
+            _path(filename).unlink(missing_ok=True)
+        except OSError:
+            failed.append(filename)
+    return failed
+
+
+def purge() -> int:
+    """Delete every object of the current tenant (pooled mode); returns how
+    many were deleted."""
+    if current_tenant.get() is None:
+        raise RuntimeError("purge() needs a tenant; it would empty the whole deployment")
+    filenames = [name for name, _ in list_objects()]
+    failed = delete_many(filenames)
+    if failed:
+        raise RuntimeError(f"{len(failed)} object(s) could not be deleted")
+    if APP_ENV != "prod" and _path("").is_dir():
+        _path("").rmdir()
+    return len(filenames)
+
+
+def list_objects() -> Iterator[tuple[str, datetime]]:
+    """Every stored object's name and last-modified time (UTC). In pooled
+    mode, only the current tenant's."""
+    prefix = _prefix()
+    if APP_ENV == "prod":
+        for page in _s3.get_paginator("list_objects_v2").paginate(Bucket=S3_BUCKET, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(prefix):], obj["LastModified"]
+    elif (UPLOAD_DIR / prefix).exists():
+        for path in (UPLOAD_DIR / prefix).iterdir():
+            if path.is_file():
+                yield path.name, datetime.fromtimestamp(path.stat().st_mtime, timezone.utc)
+
+
+def head(filename: str) -> dict | None:
+    """Size and content type of a stored object, or None if it doesn't exist."""
+    if APP_ENV == "prod":
+        try:
+            resp = _s3.head_object(Bucket=S3_BUCKET, Key=_key(filename))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": resp["ContentLength"], "content_type": resp.get("ContentType")}
+    path = _path(filename)
+    if not path.is_file():
+        return None
+    return {"size": path.stat().st_size, "content_type": None}
+
+
+# ── Streaming writes ──────────────────────────────────────────────────────────
+
+class ObjectWriter:
+    """Streams one object into storage before its name is known.
+
+    Blocking; call from a worker thread. Locally, bytes go to a temporary
+    file that commit() renames. On S3, the first MULTIPART_THRESHOLD bytes
+    are held in memory and sent with one PUT. Anything larger becomes a
+    multipart upload under a temporary key that commit() copies to its
+    final name. Either way, at most one part per file is held in memory.
+    Leftovers of a crash are picked up by the orphan sweeper (deletions.py).
+    """
+
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+        self._temp = f"incoming-{uuid.uuid4().hex}.part"
+        self._buffer = bytearray()
+        self._parts: list[dict] = []
+        self._upload_id = None
+        self._file = None
+
+    def write(self, data: bytes) -> None:
+        if APP_ENV != "prod":
+            if self._file is None:
+                self._file = _path(self._temp, create=True).open("wb")
+            self._file.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) >= MULTIPART_THRESHOLD:
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = _s3.create_multipart_upload(
+                Bucket=S3_BUCKET, Key=_key(self._temp), ContentType=self.content_type,
+            )["UploadId"]
+        number = len(self._parts) + 1
+        resp = _s3.upload_part(Bucket=S3_BUCKET, Key=_key(self._temp), UploadId=self._upload_id,
+                               PartNumber=number, Body=bytes(self._buffer))
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": number})
+        self._buffer.clear()
+
+    def commit(self, filename: str) -> bool:
+        """Store the object as `filename`. Returns False if an object with
+        that name already existed; it has the same content, so this write
+        is simply dropped."""
+        if APP_ENV != "prod":
+            if self._file is None:
+                self.write(b"")
+            self._file.close()
+            path = _path(filename)
+            if path.exists():
+                _path(self._temp).unlink()
+                return False
+            os.replace(_path(self._temp), path)
+            return True
+        if head(filename) is not None:
+            self.abort()
+            return False
+        if self._upload_id is None:
+            put(filename, bytes(self._buffer), self.content_type)
+            return True
+        if self._buffer:
+            self._upload_part()
+        temp = _key(self._temp)
+        _s3.complete_multipart_upload(Bucket=S3_BUCKET, Key=temp, UploadId=self._upload_id,
+                                      MultipartUpload={"Parts": self._parts})
+        _s3.copy_object(Bucket=S3_BUCKET, Key=_key(filename), CopySource={"Bucket": S3_BUCKET, "Key": temp},
+                        ContentType=self.content_type, CacheControl=IMMUTABLE_CACHE_CONTROL,
+                        MetadataDirective="REPLACE")
+        _s3.delete_object(Bucket=S3_BUCKET, Key=temp)
+        return True
+
+    def abort(self) -> None:
+        if APP_ENV != "prod":
+            if self._file is not None:
+                self._file.close()
+                _path(self._temp).unlink(missing_ok=True)
+            return
+        if self._upload_id is not None:
+            _s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=_key(self._temp), UploadId=self._upload_id)
+        self._buffer.clear()
+
+
+# ── Direct uploads ────────────────────────────────────────────────────────────
+
+def _signature(filename: str, expires: int, size: int, content_type: str) -> str:
+    message = f"{filename}\n{expires}\n{size}\n{content_type}".encode()
+    return hmac.new(auth.secret_key().encode(), message, hashlib.sha256).hexdigest()
+
+
+def presign_put(filename: str, content_type: str, size: int) -> dict:
+    """URL and headers for the client to PUT exactly `size` bytes to `filename`,
+    a content_key().
+
+    In prod this is a presigned S3 URL with Content-Type, Content-Length and
+    the SHA-256 checksum (taken from the key) in the signature, so S3 rejects
+    any other body. In dev it points at the signed local endpoint
+    (routers.uploads), which checks the same things.
+    """
+    checksum = base64.b64encode(bytes.fromhex(key_hash(filename))).decode()
+    headers = {"Content-Type": content_type, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if APP_ENV == "prod":
+        url = _s3.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": S3_BUCKET, "Key": _key(filename),
+                    "ContentType": content_type, "ContentLength": size,
+                    "ChecksumSHA256": checksum, "CacheControl": IMMUTABLE_CACHE_CONTROL},
+            ExpiresIn=UPLOAD_URL_EXPIRES,
+        )
+        headers["x-amz-checksum-sha256"] = checksum
+    else:
+        expires = int(time.time()) + UPLOAD_URL_EXPIRES
+        query = urlencode({"expires": expires, "size": size, "content_type": content_type,
+                           "signature": _signature(filename, expires, size, content_type)})
+        url = f"/api/uploads/{filename}?{query}"
+    return {"key": filename, "url": url, "method": "PUT", "headers": headers}
+
+
+def verify_local_put(filename: str, expires: int, size: int, content_type: str, signature: str) -> bool:
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(filename, expires, size, content_type))
+
+
+async def write_local(filename: str, chunks: AsyncIterator[bytes], size: int) -> bool:
+    """Store a signed local PUT body. Returns False, keeping nothing, unless
+    exactly `size` bytes arrive and they hash to the key."""
+    path = _path(filename, create=True)
+    partial = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    digest, received = hashlib.sha256(), 0
+    with partial.open("wb") as f:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > size:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    if received != size or digest.hexdigest() != key_hash(filename):
+        partial.unlink()
+        return False
+    partial.replace(path)
+    return True
+
+
 def public_url(filename: str | None) -> str | None:
     if not filename:
         return None
     if APP_ENV == "prod":
-        return f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{filename}"
-    return f"/uploads/{filename}"
+        return f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{_key(filename)}"
+    return f"/uploads/{_key(filename)}"
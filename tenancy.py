@@ -0,0 +1,152 @@
+"""Pooled tenancy: one horizontally scaled deployment serving every hub.
+
+With TENANCY=pooled, each hub lives in its own schema of the shared
+database (tenant_<slug>) and keeps its uploads under "<slug>/" in the
+shared bucket. TenantMiddleware reads the hub from the Host header,
+<slug>.ROOT_DOMAIN, and sets database.current_tenant for the request. The
+connection pool, read cache, storage and auth all key off that. The root
+domain serves only the marketing site and checkout.
+
+Provisioning creates a new hub's schema. After a deploy that adds tables or
+columns, bring every existing schema up to date with:
+
+    python tenancy.py migrate
+"""
+import argparse
+import os
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+import migrations
+import storage
+from cache import LRUCache
+from database import POOLED, Tenant, db, tenant_context
+from models import Profile, Post, PostImage, Tag, PostTag, Revision, PendingDeletion
+from provisioning.models import Customer, Job, Listener
+
+ROOT_DOMAIN = os.getenv("ROOT_DOMAIN", "crimata.com")
+
+# Host → tenant lookups, including misses. A cancelled hub stops resolving
+# within TENANT_CACHE_TTL.
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "10000"))
+TENANT_CACHE_TTL  = float(os.getenv("TENANT_CACHE_TTL", "30"))   # s
+
+TENANT_MODELS  = [Profile, Post, PostImage, Tag, PostTag, Revision, PendingDeletion]
+CONTROL_MODELS = [Listener, Customer, Job]
+
+# What the root domain serves; everything else needs a tenant
+_CONTROL_PAGES    = {"/", "/success"}
+_CONTROL_PREFIXES = ("/marketing/", "/assets/", "/api/checkout/", "/api/health", "/docs", "/openapi.json")
+
+_tenants = LRUCache(TENANT_CACHE_SIZE, ttl=TENANT_CACHE_TTL)
+
+
+def schema_name(slug: str) -> str:
+    return f"tenant_{slug.replace('-', '_')}"
+
+
+def tenant_for(customer: Customer) -> Tenant:
+    return Tenant(slug=customer.slug, schema=customer.db_name,
+                  secret_key=customer.secret_key, passphrase=customer.passphrase)
+
+
+def host_slug(host: str) -> str | None:
+    """"alice" for alice.crimata.com, "" for the root domain (or www), and
+    None for any other host."""
+    host = host.split(":")[0].lower().rstrip(".")
+    if host in (ROOT_DOMAIN, f"www.{ROOT_DOMAIN}"):
+        return ""
+    slug, _, domain = host.partition(".")
+    return slug if slug and domain == ROOT_DOMAIN else None
+
+
+def _load(slug: str) -> Tenant | None:
+    with db.connection_context():
+        customer = Customer.get_or_none(Customer.slug == slug, Customer.status == "active")
+    return tenant_for(customer) if customer is not None else None
+
+
+def resolve(slug: str) -> Tenant | None:
+    """The active hub with this slug. Opens its own connection on a cache miss."""
+    return _tenants.get_or_set(slug, lambda: _load(slug))
+
+
+def active_tenants() -> list[Tenant]:
+    """Every active hub. Call inside a connection context."""
+    return [tenant_for(c) for c in Customer.select().where(Customer.status == "active").order_by(Customer.id)]
+
+
+class TenantMiddleware:
+    """Serves each request as the hub its Host names, or 404s.
+
+    Requests to the root domain run without a tenant, on the public schema,
+    and only reach the marketing site, checkout and health checks. Health
+    checks are also answered for any other host, since load balancers send
+    the target's address.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        slug = host_slug(Headers(scope=scope).get("host", ""))
+        tenant = await run_in_threadpool(resolve, slug) if slug else None
+        if tenant is None:
+            control_plane = slug == "" and (path in _CONTROL_PAGES or path.startswith(_CONTROL_PREFIXES))
+            if not (control_plane or path.startswith("/api/health")):
+                await JSONResponse({"detail": "Not Found"}, status_code=404)(scope, receive, send)
+                return
+        with tenant_context(tenant):
+            await self.app(scope, receive, send)
+
+
+# ── Schemas ───────────────────────────────────────────────────────────────────
+
+def create_schema(customer: Customer) -> None:
+    """Create the hub's schema and tables, or bring them up to date. Safe to
+    re-run."""
+    with db.connection_context():
+        db.execute_sql(f'CREATE SCHEMA IF NOT EXISTS "{customer.db_name}"')
+    with tenant_context(tenant_for(customer)), db.connection_context():
+        db.create_tables(TENANT_MODELS, safe=True)
+        migrations.upgrade(migrations.TENANT_UPGRADES)
+
+
+def drop_schema(customer: Customer) -> None:
+    """Drop the hub's schema and delete its stored objects (used on cancellation)."""
+    with db.connection_context():
+        db.execute_sql(f'DROP SCHEMA IF EXISTS "{customer.db_name}" CASCADE')
+    with tenant_context(tenant_for(customer)):
+        storage.purge()
+    _tenants.invalidate(customer.slug)
+
+
+def migrate() -> int:
+    """Bring every hub's schema up to date; returns how many."""
+    with db.connection_context():
+        customers = list(Customer.select().where(Customer.status != "cancelled").order_by(Customer.id))
+    for customer in customers:
+        create_schema(customer)
+    return len(customers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pooled tenancy maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="create missing tables and columns in every hub's schema")
+    args = parser.parse_args()
+
+    if not POOLED:
+        raise SystemExit("TENANCY is not pooled")
+    if args.command == "migrate":
+        print(f"migrated {migrate()} schema(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Checkout must not serialize its Stripe round trips on the event loop.
+
+Uses the slow Stripe stand-in from benchmarks/stripe_checkout.py; no Stripe
+account or database is needed. Run from the repo root:
+
+    python -m unittest tests.test_stripe_checkout
+"""
+import unittest
+
+from benchmarks import stripe_checkout as standin
+
+
+class ConcurrentCheckoutTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = standin.serve_standin()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.should_exit = True
+
+    async def test_concurrent_checkouts_overlap(self):
+        n = standin.CONCURRENCY
+        serial = n * standin.LATENCY
+        async with standin.app_client() as client:
+            elapsed = await standin.concurrently(lambda: standin.endpoint_checkout(client), n)
+        # Overlapped, n calls take about one latency; serialized they take n.
+        self.assertLess(elapsed, serial / 4, f"{n} checkouts took {elapsed:.2f}s, serial is {serial:.2f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()